@@ -0,0 +1,387 @@
+"""Optional PyTorch Real-ESRGAN backend with fp16 batched inference.
+
+Used instead of the ncnn-vulkan binary when torch (with CUDA), basicsr and
+realesrgan are installed and matching .pth weights exist under WEIGHTS_DIR.
+Heavy imports are deferred so the API process never pays for them.
+"""
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import utils
+
+WEIGHTS_DIR = utils.BACKEND_ROOT / "weights"
+GFPGAN_WEIGHTS = WEIGHTS_DIR / f"{utils.GFPGAN_MODEL_NAME}.pth"
+# Same-sized frames per forward pass (halved automatically on CUDA OOM)
+BATCH_SIZE = 8
+# Tile edge for a single frame that does not fit untiled
+TILE_SIZE = 512
+
+# ncnn base model name -> (weights file, architecture, native scale)
+TORCH_MODELS: Dict[str, Tuple[str, str, int]] = {
+    "realesrgan-x4plus": ("RealESRGAN_x4plus.pth", "rrdb", 4),
+    "realesrgan-x4plus-anime": ("RealESRGAN_x4plus_anime_6B.pth", "rrdb6b", 4),
+    "realesr-general-x4v3": ("realesr-general-x4v3.pth", "srvgg", 4),
+}
+
+_lock = threading.Lock()
+_available: Dict[str, bool] = {}
+_upsamplers: Dict[str, object] = {}
+_restorers: Dict[Tuple[str, int], object] = {}
+_faces_available: Dict[str, bool] = {}
+
+
+def _weights_for(model: str) -> Tuple[Path, str, int] | None:
+    spec = TORCH_MODELS.get(utils.map_model_base(model))
+    if not spec:
+        return None
+    name, arch, native = spec
+    return WEIGHTS_DIR / name, arch, native
+
+
+def available(model: str) -> bool:
+    """True if the PyTorch backend can run `model` on a CUDA device (cached per model)."""
+    if model in _available:
+        return _available[model]
+    ok = False
+    spec = _weights_for(model)
+    if spec and spec[0].exists():
+        try:
+            import torch
+            import realesrgan  # noqa: F401
+            ok = bool(torch.cuda.is_available())
+        except Exception:
+            ok = False
+    _available[model] = ok
+    return ok
+
+
+def faces_available(model: str) -> bool:
+    """True if GFPGAN can run fused with the PyTorch Real-ESRGAN backend for `model`."""
+    if model in _faces_available:
+        return _faces_available[model]
+    ok = False
+    if available(model) and GFPGAN_WEIGHTS.exists():
+        try:
+            import gfpgan  # noqa: F401
+            ok = True
+        except Exception:
+            ok = False
+    _faces_available[model] = ok
+    return ok
+
+
+def _build_net(arch: str):
+    if arch == "srvgg":
+        from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+        return SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=4, act_type="prelu")
+    from basicsr.archs.rrdbnet_arch import RRDBNet
+    num_block = 6 if arch == "rrdb6b" else 23
+    return RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=num_block, num_grow_ch=32, scale=4)
+
+
+def get_upsampler(model: str):
+    """Return the process-wide RealESRGANer for `model`, loading weights once (fp16)."""
+    key = utils.map_model_base(model)
+    ups = _upsamplers.get(key)
+    if ups is not None:
+        return ups
+    spec = _weights_for(model)
+    if not spec:
+        raise RuntimeError(f"No PyTorch weights mapping for model: {model}")
+    weights, arch, native = spec
+    from realesrgan import RealESRGANer
+    ups = RealESRGANer(scale=native, model_path=str(weights), model=_build_net(arch), tile=0, half=True)
+    _upsamplers[key] = ups
+    return ups
+
+
+def get_face_restorer(model: str, outscale: int):
+    """Return a GFPGANer that uses the Real-ESRGAN upsampler for the background.
+
+    One enhance() call restores faces and upscales the rest of the frame, so
+    there is no separate ESRGAN output to write and re-read.
+    """
+    key = (utils.map_model_base(model), outscale)
+    restorer = _restorers.get(key)
+    if restorer is not None:
+        return restorer
+    from gfpgan import GFPGANer
+    restorer = GFPGANer(
+        model_path=str(GFPGAN_WEIGHTS),
+        upscale=outscale,
+        arch="clean",
+        channel_multiplier=2,
+        bg_upsampler=get_upsampler(model),
+    )
+    _restorers[key] = restorer
+    return restorer
+
+
+def enhance_batches(upsampler, batches: Iterable[list], outscale: int) -> Iterator[list]:
+    """Yield enhanced BGR frames for each list of same-sized BGR uint8 frames.
+
+    Each batch is one forward pass. Batches are staged in two reused pinned
+    host buffers, and the next one is uploaded on a side CUDA stream while the
+    current one computes. On CUDA OOM a batch is split in half (later batches
+    are capped at the size that fit); a single frame that still does not fit
+    goes through RealESRGANer's tiled path.
+    """
+    import cv2
+    import numpy as np
+    import torch
+
+    device = upsampler.device
+    copy_stream = torch.cuda.Stream(device=device)
+    native = upsampler.scale
+    pinned = [None, None]
+    copied = [None, None]
+    slot = 0
+    limit = BATCH_SIZE
+
+    def upload(imgs):
+        nonlocal slot
+        k, slot = slot, slot ^ 1
+        # The previous H2D copy out of this buffer must finish before it is refilled
+        if copied[k] is not None:
+            copied[k].synchronize()
+        shape = imgs[0].shape
+        buf = pinned[k]
+        if buf is None or buf.shape[0] < len(imgs) or tuple(buf.shape[1:]) != shape:
+            buf = pinned[k] = torch.empty((max(len(imgs), BATCH_SIZE),) + shape, dtype=torch.uint8, pin_memory=True)
+        host = buf[:len(imgs)]
+        np.stack(imgs, out=host.numpy())
+        with torch.cuda.stream(copy_stream):
+            dev = host.to(device, non_blocking=True)
+            ev = torch.cuda.Event()
+            ev.record(copy_stream)
+        copied[k] = ev
+        return dev
+
+    def launch(cur):
+        stream = torch.cuda.current_stream(device)
+        stream.wait_stream(copy_stream)
+        cur.record_stream(stream)
+        with torch.inference_mode():
+            # NHWC BGR uint8 -> NCHW RGB [0, 1]
+            x = cur.permute(0, 3, 1, 2).flip(1)
+            x = x.half() if upsampler.half else x.float()
+            y = upsampler.model(x.div_(255.0))
+            return y.clamp_(0, 1).mul_(255.0).round_().byte().flip(1).permute(0, 2, 3, 1)
+
+    def tiled(img):
+        prev = upsampler.tile_size
+        upsampler.tile_size = TILE_SIZE
+        try:
+            out, _ = upsampler.enhance(img)
+        finally:
+            upsampler.tile_size = prev
+        return out
+
+    def run_sync(imgs):
+        # No prefetch: enhance `limit`-sized parts, halving the limit on OOM
+        nonlocal limit
+        outs = []
+        pos = 0
+        while pos < len(imgs):
+            part = imgs[pos:pos + limit]
+            oom = False
+            try:
+                outs += list(launch(upload(part)).cpu().numpy())
+            except torch.cuda.OutOfMemoryError:
+                oom = True
+            if oom:
+                torch.cuda.empty_cache()
+                if len(part) == 1:
+                    outs.append(tiled(part[0]))
+                else:
+                    limit = max(1, len(part) // 2)
+                    continue
+            pos += len(part)
+        return outs
+
+    it = iter(batches)
+    imgs = next(it, None)
+    pending = None
+    while imgs is not None:
+        if pending is None and len(imgs) <= limit:
+            pending = upload(imgs)
+        y = None
+        if pending is not None:
+            try:
+                y = launch(pending)
+            except torch.cuda.OutOfMemoryError:
+                limit = max(1, len(imgs) // 2)
+            pending = None
+        if y is None:
+            torch.cuda.empty_cache()
+        # Read + upload the next batch while the GPU works on this one
+        nxt = next(it, None)
+        if y is not None and nxt is not None and len(nxt) <= limit:
+            pending = upload(nxt)
+        outs = list(y.cpu().numpy()) if y is not None else run_sync(imgs)
+        if outscale != native:
+            outs = [
+                cv2.resize(o, (o.shape[1] * outscale // native, o.shape[0] * outscale // native), interpolation=cv2.INTER_LANCZOS4)
+                for o in outs
+            ]
+        yield outs
+        imgs = nxt
+
+
+def enhance_frames(
+    pairs: List[Tuple[Path, Path]],
+    model: str,
+    outscale: int,
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> None:
+    """Enhance (input_path, output_path) frame pairs in batches of BATCH_SIZE.
+
+    Unreadable inputs are skipped (left missing) so the caller's per-frame
+    fallback can handle them. Raises RuntimeError when should_stop() turns true.
+    """
+    import cv2
+
+    readable: List[Tuple[Path, Path]] = []
+
+    def batches():
+        for start in range(0, len(pairs), BATCH_SIZE):
+            imgs = []
+            for in_path, out_path in pairs[start:start + BATCH_SIZE]:
+                img = cv2.imread(str(in_path), cv2.IMREAD_COLOR)
+                if img is None:
+                    continue
+                # Batches must be same-sized; an odd frame is left to the per-frame fallback
+                if imgs and img.shape != imgs[0].shape:
+                    continue
+                imgs.append(img)
+                readable.append((in_path, out_path))
+            if imgs:
+                yield imgs
+
+    with _lock:
+        upsampler = get_upsampler(model)
+        done = 0
+        for outs in enhance_batches(upsampler, batches(), outscale):
+            if should_stop and should_stop():
+                raise RuntimeError("Canceled")
+            for (_, out_path), out in zip(readable[done:done + len(outs)], outs):
+                cv2.imwrite(str(out_path), out)
+            done += len(outs)
+
+
+def restore_frames(
+    pairs: List[Tuple[Path, Path]],
+    model: str,
+    outscale: int,
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> None:
+    """Face-restore and upscale (input_path, output_path) pairs in a single pass each.
+
+    Unreadable inputs or failed frames are left missing for the per-frame fallback.
+    Raises RuntimeError when should_stop() turns true.
+    """
+    import cv2
+
+    with _lock:
+        restorer = get_face_restorer(model, outscale)
+        for in_path, out_path in pairs:
+            if should_stop and should_stop():
+                raise RuntimeError("Canceled")
+            img = cv2.imread(str(in_path), cv2.IMREAD_COLOR)
+            if img is None:
+                continue
+            _, _, out = restorer.enhance(img, has_aligned=False, only_center_face=False, paste_back=True)
+            if out is not None:
+                cv2.imwrite(str(out_path), out)
+
+
+def stream_video(
+    input_path: str,
+    output_path: str,
+    model: str,
+    outscale: int,
+    faces: bool = False,
+    fps: int = 30,
+    on_frame: Optional[Callable[[int, int], None]] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> int:
+    """Decode, enhance and encode a video through pipes, with no frame files on disk.
+
+    ffmpeg decodes raw BGR24 frames into batches for enhance_batches (or into
+    the fused GFPGAN restorer when `faces`), and each result is written to an
+    ffmpeg encoder that also muxes the original audio. on_frame(done, expected)
+    is called after each written frame. Returns the number of frames written;
+    raises RuntimeError on ffmpeg failure or when should_stop() turns true.
+    """
+    import numpy as np
+
+    info = utils.probe_video(input_path)
+    w, h = info["width"], info["height"]
+    if not w or not h:
+        raise RuntimeError("Could not probe video dimensions")
+    expected = max(1, int(info["duration"] * fps))
+    frame_bytes = w * h * 3
+
+    reader = utils.open_raw_reader(input_path, fps)
+    writer = utils.open_raw_writer(w * outscale, h * outscale, output_path, input_path, fps)
+
+    def frames() -> Iterator:
+        while True:
+            buf = bytearray(frame_bytes)
+            view = memoryview(buf)
+            got = 0
+            while got < frame_bytes:
+                n = reader.stdout.readinto(view[got:])
+                if not n:
+                    return
+                got += n
+            yield np.frombuffer(buf, dtype=np.uint8).reshape(h, w, 3)
+
+    def batches() -> Iterator[list]:
+        batch = []
+        for img in frames():
+            batch.append(img)
+            if len(batch) == BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    done = 0
+    try:
+        with _lock:
+            if faces:
+                restorer = get_face_restorer(model, outscale)
+                results = ([restorer.enhance(img, has_aligned=False, only_center_face=False, paste_back=True)[2]] for img in frames())
+            else:
+                results = enhance_batches(get_upsampler(model), batches(), outscale)
+            for outs in results:
+                for out in outs:
+                    if should_stop and should_stop():
+                        raise RuntimeError("Canceled")
+                    if out is None or out.shape[:2] != (h * outscale, w * outscale):
+                        raise RuntimeError("Enhanced frame has unexpected size")
+                    writer.stdin.write(np.ascontiguousarray(out).data)
+                    done += 1
+                    if on_frame:
+                        on_frame(done, expected)
+        writer.stdin.close()
+        if writer.wait() != 0:
+            raise RuntimeError(f"ffmpeg encode failed: {utils.proc_stderr(writer) or writer.returncode}")
+        if reader.wait() != 0:
+            raise RuntimeError(f"ffmpeg decode failed: {utils.proc_stderr(reader) or reader.returncode}")
+        if not done:
+            raise RuntimeError("No frames decoded")
+        return done
+    finally:
+        for proc in (reader, writer):
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            for stream in (proc.stdin, proc.stdout, proc.stderr_log):
+                if stream:
+                    try:
+                        stream.close()
+                    except Exception:
+                        pass
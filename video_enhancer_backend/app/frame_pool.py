@@ -0,0 +1,34 @@
+import queue
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+
+import numpy as np
+
+
+class FramePool:
+    """Thread-safe pool of preallocated frame buffers of a single shape.
+
+    Buffers are handed out LIFO so the most recently released (cache-warm) one
+    is reused first. get() blocks when the pool is exhausted.
+    """
+
+    def __init__(self, shape: Tuple[int, ...], size: int = 32, dtype=np.uint8):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self._q: "queue.LifoQueue[np.ndarray]" = queue.LifoQueue()
+        for _ in range(size):
+            self._q.put(np.empty(self.shape, self.dtype))
+
+    def get(self, timeout: float | None = None) -> np.ndarray:
+        return self._q.get(timeout=timeout)
+
+    def release(self, buf: np.ndarray) -> None:
+        self._q.put(buf)
+
+    @contextmanager
+    def borrow(self) -> Iterator[np.ndarray]:
+        buf = self.get()
+        try:
+            yield buf
+        finally:
+            self.release(buf)
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+TERMINAL_STATUSES = ("completed", "failed", "canceled")
+
+
+@dataclass
+class JobState:
+    """In-memory state of one processing job.
+
+    Writers go through update(), which mutates under a per-job lock and then
+    publishes an immutable `snapshot` tuple (status, progress, message, url)
+    with a single assignment. SSE readers use the snapshot without locking and
+    wait on `changed`, which is replaced each time the snapshot changes.
+    """
+
+    id: str
+    upload_path: str
+    model: str = "realesrgan-x4plus"
+    status: str = "queued"
+    progress: int = 0
+    message: str = "Queued"
+    created_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"))
+    result_path: Optional[str] = None
+    result_url: Optional[str] = None
+    canceled: bool = False
+    error: Optional[str] = None
+    started: bool = False
+    processed_frames: Optional[int] = None
+    total_frames: Optional[int] = None
+    avg_ms_per_frame: Optional[int] = None
+    snapshot: Tuple = field(default=(), repr=False, compare=False)
+    changed: asyncio.Event = field(default_factory=asyncio.Event, repr=False, compare=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+    _loop: Optional[asyncio.AbstractEventLoop] = field(default=None, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.snapshot = (self.status, self.progress, self.message, self.result_url)
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+
+    def update(self, **fields) -> None:
+        """Set fields atomically; wake watchers if the streamed snapshot changed.
+
+        Safe to call from executor threads.
+        """
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            snap = (self.status, self.progress, self.message, self.result_url)
+            if snap == self.snapshot:
+                return
+            self.snapshot = snap
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop or self._loop is None:
+            self._swap_event()
+        else:
+            self._loop.call_soon_threadsafe(self._swap_event)
+
+    def _swap_event(self) -> None:
+        ev = self.changed
+        self.changed = asyncio.Event()
+        ev.set()
+
+    def to_payload(self) -> dict:
+        """Client-facing status payload."""
+        return {
+            "id": self.id,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "resultUrl": self.result_url,
+            "model": self.model,
+            "processedFrames": self.processed_frames,
+            "totalFrames": self.total_frames,
+            "avgMsPerFrame": self.avg_ms_per_frame,
+        }
@@ -2,7 +2,6 @@ import asyncio
 import json
 import os
 import uuid
-from datetime import datetime
 from typing import AsyncGenerator, Dict, Optional
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Form
@@ -13,11 +12,12 @@ from fastapi.responses import FileResponse
 from pathlib import Path
 
 from . import utils, workers
+from .jobs import JobState, TERMINAL_STATUSES
 
 app = FastAPI(title="AI Video Enhancer Backend")
 
 # Simple in-memory job store
-JOBS: Dict[str, dict] = {}
+JOBS: Dict[str, JobState] = {}
 
 # CORS for local dev; adjust origins for production
 app.add_middleware(
@@ -57,30 +57,13 @@ async def upload_video(file: UploadFile = File(...), model: Optional[str] = Form
     upload_path = utils.upload_path(job_id, file.filename)
 
     try:
-        # Save to disk
-        with open(upload_path, "wb") as f:
-            while True:
-                chunk = await file.read(1024 * 1024)
-                if not chunk:
-                    break
-                f.write(chunk)
+        # Save to disk off the event loop, copying the spooled upload in 8 MB chunks
+        await asyncio.get_running_loop().run_in_executor(None, utils.save_upload, file.file, upload_path)
     finally:
         await file.close()
 
     # Initialize job state
-    JOBS[job_id] = {
-        "id": job_id,
-        "status": "queued",
-        "progress": 0,
-        "message": "Queued",
-        "createdAt": datetime.utcnow().isoformat() + "Z",
-        "uploadPath": upload_path,
-        "resultPath": None,
-        "resultUrl": None,
-        "canceled": False,
-        "error": None,
-        "model": model or "realesrgan-x4plus",
-    }
+    JOBS[job_id] = JobState(id=job_id, upload_path=upload_path, model=model or "realesrgan-x4plus")
 
     # Launch background processing
     asyncio.create_task(workers.process_job(job_id, JOBS))
@@ -94,17 +77,7 @@ async def get_status(job_id: str):
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     # Build client-friendly payload
-    payload = {
-        "id": job["id"],
-        "status": job["status"],
-        "progress": job.get("progress", 0),
-        "message": job.get("message", ""),
-        "resultUrl": job.get("resultUrl"),
-        "model": job.get("model"),
-        "processedFrames": job.get("processedFrames"),
-        "totalFrames": job.get("totalFrames"),
-        "avgMsPerFrame": job.get("avgMsPerFrame"),
-    }
+    payload = job.to_payload()
     return JSONResponse(payload)
 
 
@@ -128,10 +101,10 @@ async def enhance_job(payload: Dict[str, Optional[str]]):
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     if model:
-        job["model"] = model
+        job.update(model=model)
     # If somehow not started, start now
-    if job.get("status") in ("queued", "pending") and not job.get("_started"):
-        job["_started"] = True
+    if job.status in ("queued", "pending") and not job.started:
+        job.update(started=True)
         asyncio.create_task(workers.process_job(job_id, JOBS))
     return {"ok": True}
 
@@ -142,27 +115,31 @@ async def stream_status(job_id: str):
         raise HTTPException(status_code=404, detail="Job not found")
 
     async def event_generator() -> AsyncGenerator[bytes, None]:
-        last_snapshot: Optional[str] = None
+        last_snap: Optional[tuple] = None
         while True:
-            await asyncio.sleep(0.5)
             job = JOBS.get(job_id)
             if not job:
                 break
-            # Serialize
-            data = {
-                "id": job["id"],
-                "status": job["status"],
-                "progress": job.get("progress", 0),
-                "message": job.get("message", ""),
-                "resultUrl": job.get("resultUrl"),
-            }
-            snap = json.dumps(data, separators=(",", ":"))
-            if snap != last_snapshot:
-                last_snapshot = snap
-                yield f"data: {snap}\n\n".encode("utf-8")
+            # Grab the event before reading the snapshot so no update is missed
+            changed = job.changed
+            snap = job.snapshot
+            # Only serialize when the snapshot was republished
+            if snap is not last_snap:
+                last_snap = snap
+                status, progress, message, result_url = snap
+                data = {
+                    "id": job.id,
+                    "status": status,
+                    "progress": progress,
+                    "message": message,
+                    "resultUrl": result_url,
+                }
+                body = json.dumps(data, separators=(",", ":"))
+                yield f"data: {body}\n\n".encode("utf-8")
             # End stream on terminal states
-            if data["status"] in ("completed", "failed", "canceled"):
+            if snap[0] in TERMINAL_STATUSES:
                 break
+            await changed.wait()
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
@@ -172,8 +149,7 @@ async def cancel_job(job_id: str):
     job = JOBS.get(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-    job["canceled"] = True
-    job["message"] = "Cancel requested"
+    job.update(canceled=True, message="Cancel requested")
     return {"ok": True}
 
 
@@ -1,13 +1,18 @@
 import os
 import sys
 import shutil
-import zipfile
-import urllib.request
 from pathlib import Path
-from typing import Tuple
-from datetime import datetime
+from typing import Callable, Tuple
 import subprocess
-import shutil as _shutil
+import json
+import re
+import atexit
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
 
 # Resolve project root from this file: backend_root = .../video-enhancer-backend
 BACKEND_ROOT = Path(__file__).resolve().parents[1]
@@ -15,6 +20,41 @@ UPLOADS_DIR = BACKEND_ROOT / "uploads"
 RESULTS_DIR = BACKEND_ROOT / "results"
 FFMPEG_DIR = BACKEND_ROOT / "ffmpeg"
 FFMPEG_EXE = FFMPEG_DIR / ("ffmpeg.exe" if os.name == "nt" else "ffmpeg")
+FFPROBE_EXE = FFMPEG_DIR / ("ffprobe.exe" if os.name == "nt" else "ffprobe")
+# Videos at least this long are extracted in parallel keyframe-aligned segments
+PARALLEL_EXTRACT_MIN_SECONDS = 30.0
+# ncnn-vulkan load:proc:save thread counts for directory runs
+REALESRGAN_THREADS = os.environ.get("AIVE_ESRGAN_THREADS", "2:2:2")
+# Constant argument tails, built once and spliced around the per-call paths
+_ESRGAN_CONST_TAIL = ("-f", "png")
+_X264_HQ = ("-c:v", "libx264", "-pix_fmt", "yuv420p", "-preset", "slow", "-crf", "18", "-threads", "0")
+# libx264 defaults (medium preset, CRF 23) for the helpers that never asked for HQ
+_X264_DEFAULT = ("-c:v", "libx264", "-pix_fmt", "yuv420p", "-threads", "0")
+# Hardware H.264 encoders in preference order, with flags roughly matching CRF 18
+_HW_ENCODERS = (
+    ("-c:v", "h264_nvenc", "-pix_fmt", "yuv420p", "-preset", "slow", "-rc", "vbr", "-cq", "18", "-b:v", "0"),
+    ("-c:v", "h264_qsv", "-pix_fmt", "nv12", "-preset", "slow", "-global_quality", "18"),
+    ("-c:v", "h264_videotoolbox", "-pix_fmt", "yuv420p", "-q:v", "65"),
+    ("-c:v", "h264_amf", "-pix_fmt", "yuv420p", "-quality", "quality", "-rc", "cqp", "-qp_i", "18", "-qp_p", "18"),
+)
+# NVENC/QSV H.264 cannot encode frames wider (or taller) than this
+HW_ENCODER_MAX_WIDTH = 4096
+_HWACCEL = ("-hwaccel", "auto")
+_FFMPEG_QUIET = ("-nostats", "-loglevel", "error")
+_VF_2160 = ("-vf", "scale=-2:2160:flags=lanczos")
+_VF_1080 = ("-vf", "scale=-2:1080:flags=lanczos")
+_AAC_192K = ("-c:a", "aac", "-b:a", "192k")
+# Route run_realesrgan_frame through long-lived micro-batching workers
+REALESRGAN_PERSISTENT = os.environ.get("REALESRGAN_PERSISTENT") == "1"
+# Fetch tool archives with concurrent HTTP Range requests (AIVE_PARALLEL_DL=0 disables)
+PARALLEL_DOWNLOAD = os.environ.get("AIVE_PARALLEL_DL", "1") != "0"
+# Frame sequences are staged here (tmpfs on Linux) when it has room; see frames_staging_dir
+FRAMES_STAGING_DIR = Path(
+    os.environ.get("AIVE_FRAMES_DIR")
+    or ("/dev/shm/aive-frames" if sys.platform.startswith("linux") else str(BACKEND_ROOT / "frames_tmp"))
+)
+# Pipe frames ffmpeg -> PyTorch -> ffmpeg without PNG intermediates (AIVE_STREAM=0 disables)
+STREAM_MODE = os.environ.get("AIVE_STREAM", "1") != "0"
 
 # Real-ESRGAN (ncnn-vulkan portable build for Windows). We prefer a local copy.
 REALESRGAN_DIR = BACKEND_ROOT / "realesrgan"
@@ -40,9 +80,33 @@ def ensure_dirs() -> None:
     GFPGAN_DIR.mkdir(parents=True, exist_ok=True)
 
 
+def prepare_job_dirs(job_id: str, stage_dir: Path | None = None) -> dict:
+    """Create a job's working directories once, up front, and return them by name.
+
+    Keys: work, logs, frames, enhanced. frames/enhanced live under stage_dir
+    when given (see frames_staging_dir), else under the work dir. Per-frame
+    helpers such as copy_frame assume these already exist.
+    """
+    work = RESULTS_DIR / f"{job_id}_work"
+    stage = stage_dir or work
+    dirs = {
+        "work": work,
+        "logs": work / "logs",
+        "frames": stage / "frames",
+        "enhanced": stage / "enhanced",
+    }
+    for d in dirs.values():
+        d.mkdir(parents=True, exist_ok=True)
+    return dirs
+
+
+# Anything but word chars (unicode letters/digits, _), space, dot and dash
+_UNSAFE_FILENAME_RE = re.compile(r"[^\w .-]+")
+
+
+@lru_cache(maxsize=4096)
 def safe_filename(name: str) -> str:
-    keep = (" ", ".", "-", "_")
-    cleaned = ''.join(ch for ch in name if ch.isalnum() or ch in keep).strip()
+    cleaned = _UNSAFE_FILENAME_RE.sub("", name).strip()
     return cleaned or "file"
 
 
@@ -52,6 +116,16 @@ def upload_path(job_id: str, filename: str) -> str:
     return str(UPLOADS_DIR / base)
 
 
+def save_upload(fileobj, dest_path: str, chunk_size: int = 8 * 1024 * 1024) -> None:
+    """Copy an uploaded (spooled) file object to dest_path in large chunks.
+
+    Blocking; run it in an executor so the event loop isn't stalled on disk writes.
+    """
+    fileobj.seek(0)
+    with open(dest_path, "wb") as f:
+        shutil.copyfileobj(fileobj, f, chunk_size)
+
+
 def result_path(job_id: str, filename: str) -> Tuple[str, str]:
     """
     Returns (abs_path, public_url) for a result file.
@@ -70,7 +144,8 @@ def result_enhanced_timestamped_path(original_filename: str) -> Tuple[str, str]:
     The original filename is sanitized; timestamp format: YYYYMMDD_HHMMSS
     """
     stem = Path(safe_filename(original_filename)).stem or "video"
-    ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    t = time.gmtime()
+    ts = f"{t.tm_year:04d}{t.tm_mon:02d}{t.tm_mday:02d}_{t.tm_hour:02d}{t.tm_min:02d}{t.tm_sec:02d}"
     name = f"enhanced_{stem}_{ts}.mp4"
     abs_path = RESULTS_DIR / name
     public_url = f"/results/{name}"
@@ -88,12 +163,166 @@ def result_enhanced_path(job_id: str) -> Tuple[str, str]:
     return str(abs_path), public_url
 
 
+_SKIP_DIRS = frozenset({"uploads", "results", "node_modules", ".git", "venv", "__pycache__"})
+
+
+def _find_file(root: Path, targets, skip_dirs=_SKIP_DIRS, any_of: bool = False) -> dict:
+    """Locate target file names under root in a single os.scandir traversal.
+
+    Returns {name: Path} for the first match of each target. Stops as soon as
+    every target is found (or any one, with any_of=True). Directories named in
+    skip_dirs are not descended into.
+    """
+    wanted = set(targets)
+    found = {}
+    stack = [str(root)]
+    while stack and wanted:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in skip_dirs:
+                        stack.append(entry.path)
+                elif entry.name in wanted and entry.is_file(follow_symlinks=False):
+                    found[entry.name] = Path(entry.path)
+                    wanted.discard(entry.name)
+                    if any_of or not wanted:
+                        return found
+    return found
+
+
+# Resolved tool binary paths by name; dropped by ensure_* after installing
+_BIN_CACHE: dict = {}
+
+
+def _invalidate_bin_cache() -> None:
+    global _ENCODER_ARGS
+    _BIN_CACHE.clear()
+    _ENCODER_ARGS = ()
+
+
+def _cached_bin(name: str, candidates: tuple, fallback: str) -> str:
+    path = _BIN_CACHE.get(name)
+    if path is None:
+        path = next((str(c) for c in candidates if c.exists()), fallback)
+        _BIN_CACHE[name] = path
+    return path
+
+
 def ffmpeg_bin() -> str:
-    """Return the absolute path to ffmpeg binary, preferring local copy."""
-    if FFMPEG_EXE.exists():
-        return str(FFMPEG_EXE)
+    """Return the absolute path to ffmpeg binary, preferring local copy (memoized)."""
     # fallback to system ffmpeg
-    return "ffmpeg"
+    return _cached_bin("ffmpeg", (FFMPEG_EXE,), "ffmpeg")
+
+
+def ffprobe_bin() -> str:
+    """Return the absolute path to ffprobe binary, preferring local copy (memoized)."""
+    return _cached_bin("ffprobe", (FFPROBE_EXE,), "ffprobe")
+
+
+def _download_ranges(url: str, buf, workers: int = 8, min_part: int = 4 * 1024 * 1024) -> bool:
+    """Fetch url into buf with concurrent HTTP Range requests.
+
+    Returns False, leaving buf untouched, when the server doesn't answer a
+    range probe with 206 or the file is too small to be worth splitting.
+    """
+    import urllib.request
+
+    probe = urllib.request.Request(url, headers={"Range": "bytes=0-0"})
+    with urllib.request.urlopen(probe) as resp:
+        if resp.status != 206:
+            return False
+        # Reuse the post-redirect URL so each part skips the redirect hop
+        final_url = resp.geturl()
+        total_str = resp.headers.get("Content-Range", "").rpartition("/")[2]
+    if not total_str.isdigit() or int(total_str) < 2 * min_part:
+        return False
+    total = int(total_str)
+    parts = min(workers, total // min_part)
+    step = -(-total // parts)
+    write_lock = threading.Lock()
+
+    def fetch(start: int) -> None:
+        end = min(start + step, total) - 1
+        req = urllib.request.Request(final_url, headers={"Range": f"bytes={start}-{end}"})
+        with urllib.request.urlopen(req) as r:
+            if r.status != 206:
+                raise RuntimeError("Range request not honoured")
+            pos = start
+            while pos <= end:
+                block = r.read(min(1024 * 1024, end + 1 - pos))
+                if not block:
+                    raise RuntimeError("Truncated range response")
+                with write_lock:
+                    buf.seek(pos)
+                    buf.write(block)
+                pos += len(block)
+
+    with ThreadPoolExecutor(max_workers=parts) as pool:
+        list(pool.map(fetch, range(0, total, step)))
+    return True
+
+
+def _download_archive(url: str):
+    """Download url into a SpooledTemporaryFile (RAM up to 128MB) and return it rewound.
+
+    Uses parallel Range requests when the server supports them (AIVE_PARALLEL_DL=0
+    disables), otherwise a single stream.
+    """
+    import urllib.request
+
+    buf = tempfile.SpooledTemporaryFile(max_size=128 * 1024 * 1024)
+    try:
+        ranged = False
+        if PARALLEL_DOWNLOAD:
+            try:
+                ranged = _download_ranges(url, buf)
+            except Exception:
+                buf.seek(0)
+                buf.truncate()
+        if not ranged:
+            with urllib.request.urlopen(url) as resp:
+                shutil.copyfileobj(resp, buf, 1024 * 1024)
+        buf.seek(0)
+        return buf
+    except BaseException:
+        buf.close()
+        raise
+
+
+def _extract_zip_parallel(fileobj, dest: Path) -> None:
+    """Extract a zip archive into dest, decompressing members on a thread pool.
+
+    ZipFile serializes reads of the shared file object internally, so one
+    ZipFile serves all workers; inflate runs in parallel. Directories are
+    created up front, and members that would land outside dest are rejected.
+    """
+    import zipfile
+
+    root = os.path.abspath(dest)
+    with zipfile.ZipFile(fileobj) as zf:
+        jobs = []
+        for info in zf.infolist():
+            target = os.path.abspath(os.path.join(root, info.filename))
+            if os.path.commonpath([root, target]) != root:
+                raise RuntimeError(f"Unsafe path in archive: {info.filename}")
+            if info.is_dir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            jobs.append((info, target))
+
+        def extract(job):
+            info, target = job
+            with zf.open(info) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as pool:
+            # list() re-raises the first worker exception
+            list(pool.map(extract, jobs))
 
 
 def ensure_ffmpeg() -> None:
@@ -109,27 +338,19 @@ def ensure_ffmpeg() -> None:
         return
     # Windows download
     zip_url = "https://www.gyan.dev/ffmpeg/builds/ffmpeg-release-essentials.zip"
-    zip_path = FFMPEG_DIR / "ffmpeg.zip"
-    try:
-        urllib.request.urlretrieve(zip_url, str(zip_path))
-        with zipfile.ZipFile(str(zip_path), 'r') as zf:
-            zf.extractall(str(FFMPEG_DIR))
-        # Find ffmpeg.exe within extracted directories
-        exe_path = None
-        for root, dirs, files in os.walk(FFMPEG_DIR):
-            if "ffmpeg.exe" in files:
-                exe_path = Path(root) / "ffmpeg.exe"
-                break
-        if not exe_path:
-            raise FileNotFoundError("ffmpeg.exe not found after extraction")
-        # Move to FFMPEG_DIR/ffmpeg.exe
-        shutil.copyfile(str(exe_path), str(FFMPEG_EXE))
-    finally:
-        if zip_path.exists():
-            try:
-                zip_path.unlink()
-            except Exception:
-                pass
+    with _download_archive(zip_url) as buf:
+        _extract_zip_parallel(buf, FFMPEG_DIR)
+    # Find ffmpeg.exe (and ffprobe.exe) within extracted directories
+    found = _find_file(FFMPEG_DIR, {"ffmpeg.exe", "ffprobe.exe"})
+    exe_path = found.get("ffmpeg.exe")
+    probe_path = found.get("ffprobe.exe")
+    if not exe_path:
+        raise FileNotFoundError("ffmpeg.exe not found after extraction")
+    # Move to FFMPEG_DIR/ffmpeg.exe
+    _link_or_copy(exe_path, FFMPEG_EXE)
+    if probe_path:
+        _link_or_copy(probe_path, FFPROBE_EXE)
+    _invalidate_bin_cache()
 
 
 def ensure_gfpgan() -> None:
@@ -138,41 +359,57 @@ def ensure_gfpgan() -> None:
     if GFPGAN_EXE.exists():
         return
     # Try to locate if user manually extracted under BACKEND_ROOT
-    exe_path = None
-    for root, dirs, files in os.walk(BACKEND_ROOT):
-        if "gfpgan-ncnn-vulkan.exe" in files:
-            exe_path = Path(root) / "gfpgan-ncnn-vulkan.exe"
-            break
-        if "gfpgan-ncnn-vulkan" in files:
-            exe_path = Path(root) / "gfpgan-ncnn-vulkan"
-            break
+    found = _find_file(BACKEND_ROOT, {"gfpgan-ncnn-vulkan.exe", "gfpgan-ncnn-vulkan"}, any_of=True)
+    exe_path = next(iter(found.values()), None)
     if exe_path:
-        shutil.copyfile(str(exe_path), str(GFPGAN_EXE))
+        _link_or_copy(exe_path, GFPGAN_EXE)
         if os.name != "nt":
             os.chmod(str(GFPGAN_EXE), 0o755)
+        _invalidate_bin_cache()
         return
     # If not found, we leave it unavailable; worker will skip gracefully
     return
 
 
 def gfpgan_bin() -> str:
-    if GFPGAN_EXE.exists():
-        return str(GFPGAN_EXE)
-    return "gfpgan-ncnn-vulkan"
+    return _cached_bin("gfpgan", (GFPGAN_EXE,), "gfpgan-ncnn-vulkan")
+
+
+# Resolved models dir and (models_dir, mtime_ns, names) for list_available_models
+_MODELS_DIR_CACHE = ""
+_MODELS_LIST_CACHE: Tuple = ()
+
+
+def _invalidate_models_dir_cache() -> None:
+    """Forget the cached models dir/list (call after installing Real-ESRGAN)."""
+    global _MODELS_DIR_CACHE, _MODELS_LIST_CACHE
+    _MODELS_DIR_CACHE = ""
+    _MODELS_LIST_CACHE = ()
 
 
 def find_realesrgan_models_dir() -> str:
     """Return a models directory for Real-ESRGAN if present.
     Priority: nested models dir -> REALESRGAN_DIR/models -> first 'models' found under REALESRGAN_DIR.
+    The result is cached until the directory disappears.
     """
+    global _MODELS_DIR_CACHE
+    if _MODELS_DIR_CACHE and os.path.isdir(_MODELS_DIR_CACHE):
+        return _MODELS_DIR_CACHE
+    _MODELS_DIR_CACHE = _locate_models_dir()
+    return _MODELS_DIR_CACHE
+
+
+def _locate_models_dir() -> str:
     if REALESRGAN_MODELS_DIR.exists() and REALESRGAN_MODELS_DIR.is_dir():
         return str(REALESRGAN_MODELS_DIR)
     direct = REALESRGAN_DIR / "models"
     if direct.exists() and direct.is_dir():
         return str(direct)
-    for root, dirs, files in os.walk(REALESRGAN_DIR):
+    for root, dirs, _ in os.walk(REALESRGAN_DIR):
         if "models" in dirs:
             return str(Path(root) / "models")
+        # Prune in place so os.walk never descends into skipped trees
+        dirs[:] = [d for d in dirs if d not in _SKIP_DIRS]
     return ""
 
 
@@ -189,7 +426,7 @@ def model_files_available(model_name: str) -> bool:
 def resolve_model_param(model_or_param: str) -> str:
     """Resolve a model selection to a full .param path.
     Accepts base name (e.g., 'realesrgan-x4plus') or filename (e.g., 'realesrgan-x4plus.param').
-    Returns absolute path to .param; raises if not found.
+    Returns absolute path to .param (models dir is already absolute); raises if not found.
     """
     md = find_realesrgan_models_dir()
     if not md:
@@ -202,26 +439,39 @@ def resolve_model_param(model_or_param: str) -> str:
             return str(candidate)
         in_models = Path(md) / candidate.name
         if in_models.exists():
-            return str(in_models.resolve())
+            return str(in_models)
         raise FileNotFoundError(f"Model .param not found: {candidate}")
     # Treat as base name
     base = Path(md) / f"{model_or_param}.param"
     if base.exists():
-        return str(base.resolve())
+        return str(base)
     raise FileNotFoundError(f"Model .param not found for base name: {model_or_param}")
 
 
 def list_available_models() -> list:
-    """Return a list of model base names available in the detected models directory."""
+    """Return a list of model base names available in the detected models directory.
+
+    Memoized on the directory's mtime, so it is only re-listed when files change.
+    """
+    global _MODELS_LIST_CACHE
     md = find_realesrgan_models_dir()
     if not md:
         return []
+    try:
+        mtime = os.stat(md).st_mtime_ns
+    except OSError:
+        return []
+    if _MODELS_LIST_CACHE[:2] == (md, mtime):
+        return list(_MODELS_LIST_CACHE[2])
     names = set()
-    for entry in os.listdir(md):
-        if entry.endswith('.param'):
-            names.add(entry[:-6])
-        elif entry.endswith('.bin'):
-            names.add(entry[:-4])
+    with os.scandir(md) as it:
+        for entry in it:
+            n = entry.name
+            if n.endswith('.param'):
+                names.add(n[:-6])
+            elif n.endswith('.bin'):
+                names.add(n[:-4])
+    _MODELS_LIST_CACHE = (md, mtime, tuple(sorted(names)))
     return sorted(names)
 
 
@@ -251,6 +501,13 @@ def map_model_base(model: str) -> str:
     return mapping.get(m, mapping.get(stem, stem))
 
 
+def _find_realesrgan_files(root: Path) -> Tuple:
+    """Return (exe, model .param, model .bin) paths under root; None for any not found."""
+    names = ("realesrgan-ncnn-vulkan.exe", f"{REALESRGAN_MODEL_NAME}.param", f"{REALESRGAN_MODEL_NAME}.bin")
+    found = _find_file(root, names)
+    return tuple(found.get(n) for n in names)
+
+
 def ensure_realesrgan() -> None:
     """Ensure Real-ESRGAN (ncnn-vulkan) exists locally with the general x4v3 model.
 
@@ -266,24 +523,15 @@ def ensure_realesrgan() -> None:
 
     # If the user manually extracted the archive elsewhere under BACKEND_ROOT,
     # try to locate and move the files into REALESRGAN_DIR before downloading.
-    exe_path = None
-    model_param = None
-    model_bin = None
-    for root, dirs, files in os.walk(BACKEND_ROOT):
-        if not exe_path and "realesrgan-ncnn-vulkan.exe" in files:
-            exe_path = Path(root) / "realesrgan-ncnn-vulkan.exe"
-        if not model_param and f"{REALESRGAN_MODEL_NAME}.param" in files:
-            model_param = Path(root) / f"{REALESRGAN_MODEL_NAME}.param"
-        if not model_bin and f"{REALESRGAN_MODEL_NAME}.bin" in files:
-            model_bin = Path(root) / f"{REALESRGAN_MODEL_NAME}.bin"
-        if exe_path and model_param and model_bin:
-            break
+    exe_path, model_param, model_bin = _find_realesrgan_files(BACKEND_ROOT)
     if exe_path:
-        shutil.copyfile(str(exe_path), str(REALESRGAN_EXE))
+        _link_or_copy(exe_path, REALESRGAN_EXE)
         if model_param:
-            shutil.copyfile(str(model_param), str(REALESRGAN_DIR / model_param.name))
+            _link_or_copy(model_param, REALESRGAN_DIR / model_param.name)
         if model_bin:
-            shutil.copyfile(str(model_bin), str(REALESRGAN_DIR / model_bin.name))
+            _link_or_copy(model_bin, REALESRGAN_DIR / model_bin.name)
+        _invalidate_models_dir_cache()
+        _invalidate_bin_cache()
         return
     # Download ncnn-vulkan Windows build (includes models). Try several mirrors/versions.
     candidate_urls = [
@@ -294,112 +542,127 @@ def ensure_realesrgan() -> None:
         # 20210210 legacy (as a fallback)
         "https://github.com/xinntao/Real-ESRGAN-ncnn-vulkan/releases/download/20210210/Real-ESRGAN-ncnn-vulkan-20210210-windows.zip",
     ]
-    zip_path = REALESRGAN_DIR / "realesrgan.zip"
+    import urllib.request
+
     last_err = None
-    try:
-        # Use a browser-like user-agent to avoid 403 on some endpoints
-        opener = urllib.request.build_opener()
-        opener.addheaders = [("User-Agent", "Mozilla/5.0")]
-        urllib.request.install_opener(opener)
+    buf = None
+    # Use a browser-like user-agent to avoid 403 on some endpoints
+    opener = urllib.request.build_opener()
+    opener.addheaders = [("User-Agent", "Mozilla/5.0")]
+    urllib.request.install_opener(opener)
 
-        for url in candidate_urls:
-            try:
-                urllib.request.urlretrieve(url, str(zip_path))
-                break
-            except Exception as e:
-                last_err = e
-                continue
-        else:
-            raise last_err or RuntimeError("Failed to download Real-ESRGAN archive from all mirrors")
-        with zipfile.ZipFile(str(zip_path), 'r') as zf:
-            zf.extractall(str(REALESRGAN_DIR))
-        # Find executable and desired model files
-        exe_path = None
-        model_param = None
-        model_bin = None
-        for root, dirs, files in os.walk(REALESRGAN_DIR):
-            if not exe_path and "realesrgan-ncnn-vulkan.exe" in files:
-                exe_path = Path(root) / "realesrgan-ncnn-vulkan.exe"
-            if not model_param and f"{REALESRGAN_MODEL_NAME}.param" in files:
-                model_param = Path(root) / f"{REALESRGAN_MODEL_NAME}.param"
-            if not model_bin and f"{REALESRGAN_MODEL_NAME}.bin" in files:
-                model_bin = Path(root) / f"{REALESRGAN_MODEL_NAME}.bin"
-        if not exe_path:
-            raise FileNotFoundError("realesrgan executable not found after extraction")
-        # Copy exe to root dir
-        if os.name == "nt":
-            shutil.copyfile(str(exe_path), str(REALESRGAN_EXE))
-        else:
-            shutil.copyfile(str(exe_path), str(REALESRGAN_EXE))
-            os.chmod(str(REALESRGAN_EXE), 0o755)
-        # Copy model files (if present); optional if exe bundles models
-        if model_param:
-            shutil.copyfile(str(model_param), str(REALESRGAN_DIR / model_param.name))
-        if model_bin:
-            shutil.copyfile(str(model_bin), str(REALESRGAN_DIR / model_bin.name))
-    finally:
-        if zip_path.exists():
-            try:
-                zip_path.unlink()
-            except Exception:
-                pass
+    for url in candidate_urls:
+        try:
+            buf = _download_archive(url)
+            break
+        except Exception as e:
+            last_err = e
+            continue
+    else:
+        raise last_err or RuntimeError("Failed to download Real-ESRGAN archive from all mirrors")
+    with buf:
+        _extract_zip_parallel(buf, REALESRGAN_DIR)
+    # Find executable and desired model files
+    exe_path, model_param, model_bin = _find_realesrgan_files(REALESRGAN_DIR)
+    if not exe_path:
+        raise FileNotFoundError("realesrgan executable not found after extraction")
+    # Copy exe to root dir
+    if os.name == "nt":
+        _link_or_copy(exe_path, REALESRGAN_EXE)
+    else:
+        _link_or_copy(exe_path, REALESRGAN_EXE)
+        os.chmod(str(REALESRGAN_EXE), 0o755)
+    # Copy model files (if present); optional if exe bundles models
+    if model_param:
+        _link_or_copy(model_param, REALESRGAN_DIR / model_param.name)
+    if model_bin:
+        _link_or_copy(model_bin, REALESRGAN_DIR / model_bin.name)
+    _invalidate_models_dir_cache()
+    _invalidate_bin_cache()
 
 
 def realesrgan_bin() -> str:
     # Prefer nested exe if present (no need to move files)
-    if REALESRGAN_NESTED_EXE.exists():
-        return str(REALESRGAN_NESTED_EXE)
-    if REALESRGAN_EXE.exists():
-        return str(REALESRGAN_EXE)
-    return "realesrgan-ncnn-vulkan"
+    return _cached_bin("realesrgan", (REALESRGAN_NESTED_EXE, REALESRGAN_EXE), "realesrgan-ncnn-vulkan")
 
 
-def run_realesrgan_frame(input_path: str, output_path: str, model: str = REALESRGAN_MODEL_NAME, scale: int = 4, gpu_id: str | None = None) -> None:
-    """Enhance a single frame image using Real-ESRGAN (ncnn-vulkan).
+def _esrgan_threads(threads: str, gpu_id: str | None) -> str:
+    """Repeat the proc count of a load:proc:save -j spec once per GPU in gpu_id ("0,1")."""
+    parts = threads.split(":")
+    if len(parts) != 3:
+        return threads
+    load, proc, save = parts
+    n = len(gpu_id.split(",")) if gpu_id else 1
+    return f"{load}:{','.join([proc.split(',')[0]] * n)}:{save}"
 
-    Correct CLI usage:
-    -m <models_dir> and -n <model_base_name>, not a .param path.
-    Uses absolute paths for input/output, and prefers GPU order 1 -> 0 -> auto.
-    Raises RuntimeError with a concise stderr snippet on failure so callers can surface it.
+
+def _run_cancelable(cmd: tuple, should_stop: Callable[[], bool]) -> None:
+    """Like subprocess.run(cmd, check=True), but terminates cmd once should_stop() is true."""
+    proc = _popen_logged(list(cmd), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                proc.wait(timeout=0.5)
+                break
+            except subprocess.TimeoutExpired:
+                if should_stop():
+                    proc.terminate()
+                    try:
+                        proc.wait(timeout=5)
+                    except subprocess.TimeoutExpired:
+                        proc.kill()
+                        proc.wait()
+                    break
+        if proc.returncode:
+            proc.stderr_log.seek(0)
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=proc.stderr_log.read())
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stderr_log.close()
+
+
+def _exec_realesrgan(base: tuple, gpu_id: str | None = None, threads: str | None = None, should_stop: Callable[[], bool] | None = None) -> None:
+    """Run a Real-ESRGAN command line, trying GPU variants in order.
+
+    Prefers the requested GPU (or comma-separated GPU list), then 1 -> 0 -> auto.
+    With `threads`, each variant gets a -j whose proc list matches its GPU count.
+    With `should_stop`, the running variant is terminated (polled every 0.5 s)
+    and RuntimeError("Canceled") raised once it turns true.
+    Raises RuntimeError with a concise stderr snippet on failure so callers can
+    surface it.
     """
-    exe = realesrgan_bin()
-    models_dir = find_realesrgan_models_dir()
-    if not models_dir:
-        raise RuntimeError("Real-ESRGAN models directory not found")
-    # Normalize to base model name
-    model_base = map_model_base(model)
-    # Absolute IO paths
-    in_abs = str(Path(input_path).resolve())
-    out_abs = str(Path(output_path).resolve())
-    base = [
-        exe,
-        "-m", models_dir,
-        "-i", in_abs,
-        "-o", out_abs,
-        "-n", model_base,
-        "-s", str(scale),
-        "-f", "png",
-    ]
     tried = []
-    def with_gpu(args, gflag):
-        return [args[0], "-g", gflag] + args[1:]
-    variants = []
+    gpus = []
     if gpu_id is not None:
-        variants.append(with_gpu(base, str(gpu_id)))
+        gpu_id = str(gpu_id)
+        gpus.append(gpu_id)
         # Fall back to the other common ids and auto
-        if str(gpu_id) != "0":
-            variants.append(with_gpu(base, "0"))
-        if str(gpu_id) != "1":
-            variants.append(with_gpu(base, "1"))
-        variants.append(base)
+        if gpu_id != "0":
+            gpus.append("0")
+        if gpu_id != "1":
+            gpus.append("1")
+        gpus.append(None)
     else:
-        variants = [with_gpu(base, "1"), with_gpu(base, "0"), base]
+        gpus = ["1", "0", None]
+    variants = [
+        base
+        + (("-j", _esrgan_threads(threads, g)) if threads else ())
+        + (("-g", g) if g is not None else ())
+        for g in gpus
+    ]
     last_err = None
     for cmd in variants:
+        if should_stop and should_stop():
+            raise RuntimeError("Canceled")
         try:
             # Print the command for diagnostics
             print("[ESRGAN] exec:", " ".join(cmd))
-            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            if should_stop:
+                _run_cancelable(cmd, should_stop)
+            else:
+                subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
             return
         except subprocess.CalledProcessError as e:
             err = e.stderr.decode(errors="ignore") if e.stderr else ""
@@ -413,52 +676,393 @@ def run_realesrgan_frame(input_path: str, output_path: str, model: str = REALESR
     raise RuntimeError(f"ESRGAN error: {tail_snippet}") from last_err
 
 
+def run_realesrgan_frame(input_path: str, output_path: str, model: str = REALESRGAN_MODEL_NAME, scale: int = 4, gpu_id: str | None = None) -> None:
+    """Enhance a single frame image using Real-ESRGAN (ncnn-vulkan).
+
+    Correct CLI usage:
+    -m <models_dir> and -n <model_base_name>, not a .param path.
+    Uses absolute paths for input/output, and prefers GPU order 1 -> 0 -> auto.
+    Raises RuntimeError with a concise stderr snippet on failure so callers can surface it.
+    With REALESRGAN_PERSISTENT=1 the frame is batched with concurrent callers instead.
+    """
+    if REALESRGAN_PERSISTENT:
+        get_realesrgan_worker(model, scale, gpu_id).submit(input_path, output_path).result()
+        return
+    exe = realesrgan_bin()
+    models_dir = find_realesrgan_models_dir()
+    if not models_dir:
+        raise RuntimeError("Real-ESRGAN models directory not found")
+    # Normalize to base model name
+    model_base = map_model_base(model)
+    # Absolute IO paths; abspath is lexical (frames/ holds no symlinks), resolve() would lstat each component
+    in_abs = os.path.abspath(input_path)
+    out_abs = os.path.abspath(output_path)
+    base = (exe, "-m", models_dir, "-i", in_abs, "-o", out_abs, "-n", model_base, "-s", str(scale)) + _ESRGAN_CONST_TAIL
+    _exec_realesrgan(base, gpu_id)
+
+
+def run_realesrgan_dir(input_dir: str, output_dir: str, model: str = REALESRGAN_MODEL_NAME, scale: int = 4, gpu_id: str | None = None, threads: str | None = None, should_stop: Callable[[], bool] | None = None) -> None:
+    """Enhance every image in input_dir with a single Real-ESRGAN invocation.
+
+    The model is loaded once and ncnn-vulkan pipelines load/proc/save across
+    frames (-j, default REALESRGAN_THREADS), instead of paying process + Vulkan
+    init per frame. gpu_id may list several devices ("0,1"); the -j proc count
+    is then repeated per device so the frames are split across them. Outputs
+    keep the input file names (with a .png extension) in output_dir. The run is
+    terminated early once should_stop() returns true (e.g. a canceled job).
+    """
+    exe = realesrgan_bin()
+    models_dir = find_realesrgan_models_dir()
+    if not models_dir:
+        raise RuntimeError("Real-ESRGAN models directory not found")
+    model_base = map_model_base(model)
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    base = (
+        exe,
+        "-m", models_dir,
+        "-i", os.path.abspath(input_dir),
+        "-o", os.path.abspath(output_dir),
+        "-n", model_base,
+        "-s", str(scale),
+    ) + _ESRGAN_CONST_TAIL
+    _exec_realesrgan(base, gpu_id, threads or REALESRGAN_THREADS, should_stop)
+
+
+class RealesrganWorker:
+    """Long-lived Real-ESRGAN runner for one (model, scale, gpu) that micro-batches frames.
+
+    realesrgan-ncnn-vulkan has no watch/daemon mode, so rather than one process
+    per frame, frames submitted within BATCH_WAIT seconds of each other are
+    linked into one staging dir and enhanced by a single run_realesrgan_dir call.
+    """
+
+    BATCH_WAIT = 0.05
+    MAX_BATCH = 64
+
+    def __init__(self, model: str, scale: int, gpu_id: str | None = None):
+        self.model = model
+        self.scale = scale
+        self.gpu_id = gpu_id
+        self._q: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"esrgan-{model}-x{scale}-g{gpu_id}", daemon=True)
+        self._thread.start()
+
+    def submit(self, input_path: str, output_path: str) -> Future:
+        """Queue one frame; the future resolves once output_path is written (its dir must exist)."""
+        fut: Future = Future()
+        self._q.put((str(input_path), str(output_path), fut))
+        return fut
+
+    def close(self, timeout: float = 5.0) -> None:
+        self._q.put(None)
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while True:
+            item = self._q.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.BATCH_WAIT
+            while len(batch) < self.MAX_BATCH:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    break
+                try:
+                    nxt = self._q.get(timeout=wait)
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop = True
+                    break
+                batch.append(nxt)
+            self._run_batch(batch)
+            if stop:
+                return
+
+    def _run_batch(self, batch: list) -> None:
+        batch = [b for b in batch if b[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        stage = Path(tempfile.mkdtemp(prefix="esrgan_", dir=str(RESULTS_DIR)))
+        in_dir, out_dir = stage / "in", stage / "out"
+        in_dir.mkdir()
+        staged = []
+        try:
+            for src, out_path, fut in batch:
+                name = f"{len(staged):06d}"
+                dst = in_dir / (name + Path(src).suffix)
+                try:
+                    try:
+                        os.link(src, dst)
+                    except OSError:
+                        shutil.copyfile(src, dst)
+                except OSError as e:
+                    fut.set_exception(e)
+                    continue
+                staged.append((name, out_path, fut))
+            if staged:
+                run_realesrgan_dir(str(in_dir), str(out_dir), self.model, self.scale, self.gpu_id)
+            for name, out_path, fut in staged:
+                produced = out_dir / f"{name}.png"
+                if produced.exists():
+                    shutil.move(str(produced), out_path)
+                    fut.set_result(None)
+                else:
+                    fut.set_exception(RuntimeError("ESRGAN error: no output produced"))
+        except Exception as e:
+            for _, _, fut in staged:
+                if not fut.done():
+                    fut.set_exception(e)
+        finally:
+            shutil.rmtree(stage, ignore_errors=True)
+
+
+_esrgan_workers: dict = {}
+_esrgan_workers_lock = threading.Lock()
+
+
+def get_realesrgan_worker(model: str, scale: int, gpu_id: str | None = None) -> RealesrganWorker:
+    """Return the shared worker for (model, scale, gpu), starting it on first use."""
+    key = (map_model_base(model), int(scale), None if gpu_id is None else str(gpu_id))
+    with _esrgan_workers_lock:
+        worker = _esrgan_workers.get(key)
+        if worker is None:
+            worker = _esrgan_workers[key] = RealesrganWorker(*key)
+        return worker
+
+
+@atexit.register
+def _close_realesrgan_workers() -> None:
+    with _esrgan_workers_lock:
+        workers = list(_esrgan_workers.values())
+        _esrgan_workers.clear()
+    for worker in workers:
+        worker.close()
+
+
 # --- Frame validation & utilities ---
 def is_image_nonblack(path: str) -> bool:
     """Return True if the image has any non-zero pixel (i.e., not fully black).
 
-    Prefers Pillow for accuracy; falls back to a size heuristic if Pillow isn't available.
+    Prefers OpenCV (SIMD decode + countNonZero), then Pillow; falls back to a
+    size heuristic if neither is available.
     """
     p = Path(path)
     if not p.exists() or p.stat().st_size == 0:
         return False
+    try:
+        import cv2
+        img = cv2.imread(str(p), cv2.IMREAD_GRAYSCALE)
+        if img is not None:
+            return cv2.countNonZero(img) > 0
+    except ImportError:
+        pass
     try:
         from PIL import Image
         with Image.open(str(p)) as img:
-            # Convert to L (grayscale) quickly and check extrema
-            g = img.convert("L")
-            lo, hi = g.getextrema()
-            return (hi or 0) > 0
+            if img.mode == "P":
+                # Extrema of palette indices say nothing about colour
+                img = img.convert("RGB")
+            # Per-band extrema on the native mode; no grayscale copy
+            ex = img.getextrema()
+            if not isinstance(ex[0], tuple):
+                return (ex[1] or 0) > 0
+            bands = img.getbands()
+            return any((hi or 0) > 0 for band, (_, hi) in zip(bands, ex) if band != "A")
     except Exception:
         # Fallback: consider non-trivially small PNGs as likely non-black
         # (still better than nothing if PIL isn't installed)
         return p.stat().st_size > 1000
 
 
+def validate_frames_batch(paths: list, threshold: int = 0) -> set:
+    """Return the positions in ``paths`` of frames that are missing, empty or black.
+
+    Sizes are checked first so missing/empty files are never decoded. Remaining
+    frames are decoded one at a time with OpenCV and flagged by their peak value
+    (a C-level reduction on the decoded image, so only one frame is resident at
+    a time). Falls back to is_image_nonblack per frame without OpenCV.
+    """
+    bad = set()
+    candidates = []
+    for i, p in enumerate(paths):
+        try:
+            if os.stat(p).st_size > 0:
+                candidates.append(i)
+                continue
+        except OSError:
+            pass
+        bad.add(i)
+    try:
+        import cv2
+    except Exception:
+        bad.update(i for i in candidates if not is_image_nonblack(str(paths[i])))
+        return bad
+    for i in candidates:
+        img = cv2.imread(str(paths[i]), cv2.IMREAD_COLOR)
+        if img is None or int(img.max()) <= threshold:
+            bad.add(i)
+    return bad
+
+
+def _copy_file_range(src: str, dst: str) -> bool:
+    """In-kernel copy via os.copy_file_range (reflinks on XFS/Btrfs). False if unsupported."""
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if n == 0:
+                    break
+                remaining -= n
+        return remaining == 0
+    except OSError:
+        return False
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    """Make dst hold src's content, replacing dst if it exists.
+
+    Tries a hard link first (O(1) on the same filesystem; swapped in with
+    os.replace so an existing dst is overwritten atomically), then an in-kernel
+    copy_file_range, then shutil.copyfile (sendfile on Linux). Callers must
+    replace, not rewrite in place, a linked dst or src would change too.
+    """
+    src, dst = str(src), str(dst)
+    if os.path.abspath(src) == os.path.abspath(dst):
+        return
+    tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.lnk"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        pass
+    else:
+        try:
+            os.replace(tmp, dst)
+            return
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+    if hasattr(os, "copy_file_range") and _copy_file_range(src, dst):
+        return
+    shutil.copyfile(src, dst)
+
+
 def copy_frame(src: str, dst: str) -> None:
-    """Copy frame file from src to dst (overwrite if exists)."""
-    Path(dst).parent.mkdir(parents=True, exist_ok=True)
-    _shutil.copyfile(src, dst)
+    """Copy frame file from src to dst (overwrite if exists).
+
+    Hard-links when possible; see _link_or_copy. Enhanced frames are only ever
+    replaced (never rewritten in place), so sharing an inode is safe. The
+    destination directory must already exist (see prepare_job_dirs).
+    """
+    _link_or_copy(src, dst)
+
+
+def list_frames(frames_dir: str, prefix: str, suffix: str = ".png") -> list:
+    """Return non-empty `<prefix>*<suffix>` files in frames_dir as sorted Paths.
+
+    One os.scandir pass; DirEntry.stat() is served from the directory read
+    where the OS allows, instead of glob + exists() + stat() per frame.
+    """
+    entries = []
+    with os.scandir(frames_dir) as it:
+        for e in it:
+            n = e.name
+            if n.startswith(prefix) and n.endswith(suffix) and e.stat().st_size > 0:
+                entries.append(e)
+    entries.sort(key=lambda e: e.name)
+    return [Path(e.path) for e in entries]
+
+
+def count_frames(frames_dir: str, prefix: str, suffix: str = ".png") -> int:
+    """Count `<prefix>*<suffix>` names in frames_dir without stat'ing them."""
+    try:
+        with os.scandir(frames_dir) as it:
+            return sum(1 for e in it if e.name.startswith(prefix) and e.name.endswith(suffix))
+    except OSError:
+        return 0
+
+
+def probe_frame_shape(path: str) -> Tuple[int, int, int] | None:
+    """Return (height, width, channels) of a frame image, or None if OpenCV is unavailable."""
+    try:
+        import cv2
+    except Exception:
+        return None
+    img = cv2.imread(str(path), cv2.IMREAD_COLOR)
+    return tuple(img.shape) if img is not None else None
+
+
+def copy_frame_buf(pool, src: str, dst: str) -> None:
+    """Copy a frame to dst through a pooled buffer, resizing it to the pool's frame shape.
+
+    Used when a source frame stands in for a failed enhanced one, so the output
+    sequence keeps a single resolution. Falls back to copy_frame without OpenCV.
+    """
+    try:
+        import cv2
+    except Exception:
+        copy_frame(src, dst)
+        return
+    img = cv2.imread(str(src), cv2.IMREAD_COLOR)
+    if img is None:
+        raise RuntimeError(f"Unreadable frame: {src}")
+    if img.shape == pool.shape:
+        cv2.imwrite(str(dst), img)
+        return
+    h, w = pool.shape[:2]
+    with pool.borrow() as buf:
+        cv2.resize(img, (w, h), dst=buf, interpolation=cv2.INTER_LANCZOS4)
+        cv2.imwrite(str(dst), buf)
+
+
+# Open line-buffered log files, keyed by path
+_LOG_HANDLES: dict = {}
+_log_lock = threading.Lock()
 
 
 def write_log(log_path: str, message: str) -> None:
-    """Append a message line to the given log file."""
+    """Append a message line to the given log file.
+
+    The file is opened once and kept open (line-buffered) until close_log().
+    """
     try:
-        lp = Path(log_path)
-        lp.parent.mkdir(parents=True, exist_ok=True)
-        with open(lp, "a", encoding="utf-8") as f:
-            f.write(message.rstrip() + "\n")
+        with _log_lock:
+            fh = _LOG_HANDLES.get(log_path)
+            if fh is None:
+                Path(log_path).parent.mkdir(parents=True, exist_ok=True)
+                fh = _LOG_HANDLES[log_path] = open(log_path, "a", encoding="utf-8", buffering=1)
+            fh.write(message.rstrip() + "\n")
     except Exception:
         pass
 
 
+def close_log(log_path: str) -> None:
+    """Close the handle write_log keeps for log_path, if any."""
+    with _log_lock:
+        fh = _LOG_HANDLES.pop(log_path, None)
+    if fh is not None:
+        try:
+            fh.close()
+        except Exception:
+            pass
+
+
+@atexit.register
+def _close_logs() -> None:
+    for path in list(_LOG_HANDLES):
+        close_log(path)
+
+
 def run_gfpgan_frame(input_path: str, output_path: str, model: str = GFPGAN_MODEL_NAME) -> None:
     """Enhance faces on a single frame via GFPGAN (ncnn-vulkan)."""
-    base = [gfpgan_bin(), "-i", input_path, "-o", output_path, "-n", model, "-f", "png"]
+    base = (gfpgan_bin(), "-i", input_path, "-o", output_path, "-n", model) + _ESRGAN_CONST_TAIL
     tried = []
-    def with_gpu(args, gflag):
-        return [args[0], "-g", gflag] + args[1:]
-    variants = [with_gpu(base, "1"), with_gpu(base, "0"), base, with_gpu(base, "-1")]
+    variants = [base + ("-g", "1"), base + ("-g", "0"), base, base + ("-g", "-1")]
     last_err = None
     for cmd in variants:
         try:
@@ -473,20 +1077,87 @@ def run_gfpgan_frame(input_path: str, output_path: str, model: str = GFPGAN_MODE
     raise RuntimeError(f"GFPGAN failed for frame. Attempts:\n{diag}") from last_err
 
 
+# Video encoder flags chosen by _select_encoder
+_ENCODER_ARGS: tuple = ()
+
+
+def _select_encoder(out_width: int = 0) -> tuple:
+    """Return -c:v/-pix_fmt/quality flags for the best working H.264 encoder (probed once).
+
+    Hardware encoders appear in `ffmpeg -encoders` whenever they are compiled
+    in, so each listed one is trial-encoded on a tiny frame before it is used.
+    Falls back to libx264, always for outputs wider than HW_ENCODER_MAX_WIDTH.
+    _run_ffmpeg also retries a failed hardware encode with libx264.
+    """
+    global _ENCODER_ARGS
+    if out_width > HW_ENCODER_MAX_WIDTH:
+        return _X264_HQ
+    if _ENCODER_ARGS:
+        return _ENCODER_ARGS
+    chosen = _X264_HQ
+    try:
+        res = subprocess.run([ffmpeg_bin(), "-hide_banner", "-encoders"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=15)
+        listed = res.stdout.decode(errors="ignore")
+        for args in _HW_ENCODERS:
+            if f" {args[1]} " not in listed:
+                continue
+            trial = [
+                ffmpeg_bin(), "-v", "error",
+                "-f", "lavfi", "-i", "color=c=black:s=256x256:d=0.1",
+                "-frames:v", "1", *args, "-f", "null", "-",
+            ]
+            if subprocess.run(trial, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=30).returncode == 0:
+                chosen = args
+                break
+    except (OSError, subprocess.SubprocessError):
+        pass
+    _ENCODER_ARGS = chosen
+    return chosen
+
+
+def _software_fallback(cmd: list) -> list | None:
+    """Return cmd with the spliced-in hardware encoder flags replaced by libx264, or None."""
+    enc = _ENCODER_ARGS
+    if not enc or enc is _X264_HQ:
+        return None
+    n = len(enc)
+    for i in range(len(cmd) - n + 1):
+        if tuple(cmd[i:i + n]) == enc:
+            return [*cmd[:i], *_X264_HQ, *cmd[i + n:]]
+    return None
+
+
+def _run_ffmpeg(cmd: list, what: str = "ffmpeg") -> None:
+    """Run an ffmpeg command, raising RuntimeError with the stderr tail on failure.
+
+    Output is discarded and only errors are logged (-nostats -loglevel error),
+    so stderr stays small and never backs up the pipe on long encodes. A failed
+    hardware encode (e.g. beyond the encoder's size limits) is rerun once with
+    libx264.
+    """
+    res = subprocess.run([cmd[0], *_FFMPEG_QUIET, *cmd[1:]], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if res.returncode != 0:
+        sw = _software_fallback(cmd)
+        if sw is not None:
+            res = subprocess.run([sw[0], *_FFMPEG_QUIET, *sw[1:]], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if res.returncode != 0:
+        err = res.stderr.decode(errors="ignore").strip()
+        raise RuntimeError((("…" + err[-240:]) if len(err) > 240 else err) or f"{what} failed (exit {res.returncode})")
+
+
 def run_ffmpeg_scale_720p(input_path: str, output_path: str) -> None:
     """Resize video to 1280x720 and copy audio if possible."""
     cmd = [
         ffmpeg_bin(),
         "-y",
+        *_HWACCEL,
         "-i", input_path,
         "-vf", "scale=1280:720",
-        "-c:v", "libx264",
-        "-pix_fmt", "yuv420p",
-        "-c:a", "aac",
-        "-b:a", "192k",
+        *_X264_DEFAULT,
+        *_AAC_192K,
         output_path,
     ]
-    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _run_ffmpeg(cmd)
 
 
 def combine_frames_audio_2160p(frames_pattern: str, audio_path: str, output_path: str, fps: int = 30) -> None:
@@ -497,16 +1168,13 @@ def combine_frames_audio_2160p(frames_pattern: str, audio_path: str, output_path
         "-framerate", str(fps),
         "-i", frames_pattern,
         "-i", audio_path,
-        "-vf", "scale=-2:2160:flags=lanczos",
-        "-c:v", "libx264",
-        "-pix_fmt", "yuv420p",
-        "-preset", "slow",
-        "-crf", "18",
+        *_VF_2160,
+        *_select_encoder(),
         "-c:a", "aac",
         "-shortest",
         output_path,
     ]
-    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _run_ffmpeg(cmd)
 
 
 def combine_frames_video_only_2160p(frames_pattern: str, output_path: str, fps: int = 30) -> None:
@@ -519,15 +1187,12 @@ def combine_frames_video_only_2160p(frames_pattern: str, output_path: str, fps:
         "-y",
         "-framerate", str(fps),
         "-i", frames_pattern,
-        "-vf", "scale=-2:2160:flags=lanczos",
-        "-c:v", "libx264",
-        "-pix_fmt", "yuv420p",
-        "-preset", "slow",
-        "-crf", "18",
+        *_VF_2160,
+        *_select_encoder(),
         "-an",
         output_path,
     ]
-    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _run_ffmpeg(cmd)
 
 
 def run_ffmpeg_scale_2160p(input_path: str, output_path: str) -> None:
@@ -535,17 +1200,14 @@ def run_ffmpeg_scale_2160p(input_path: str, output_path: str) -> None:
     cmd = [
         ffmpeg_bin(),
         "-y",
+        *_HWACCEL,
         "-i", input_path,
-        "-vf", "scale=-2:2160:flags=lanczos",
-        "-c:v", "libx264",
-        "-pix_fmt", "yuv420p",
-        "-preset", "slow",
-        "-crf", "18",
-        "-c:a", "aac",
-        "-b:a", "192k",
+        *_VF_2160,
+        *_select_encoder(),
+        *_AAC_192K,
         output_path,
     ]
-    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _run_ffmpeg(cmd)
 
 
 def combine_frames_audio_1080p(frames_pattern: str, audio_path: str, output_path: str, fps: int = 30) -> None:
@@ -556,16 +1218,13 @@ def combine_frames_audio_1080p(frames_pattern: str, audio_path: str, output_path
         "-framerate", str(fps),
         "-i", frames_pattern,
         "-i", audio_path,
-        "-vf", "scale=-2:1080:flags=lanczos",
-        "-c:v", "libx264",
-        "-pix_fmt", "yuv420p",
-        "-preset", "slow",
-        "-crf", "18",
+        *_VF_1080,
+        *_select_encoder(),
         "-c:a", "aac",
         "-shortest",
         output_path,
     ]
-    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _run_ffmpeg(cmd)
 
 
 def run_ffmpeg_scale_1080p(input_path: str, output_path: str) -> None:
@@ -573,32 +1232,273 @@ def run_ffmpeg_scale_1080p(input_path: str, output_path: str) -> None:
     cmd = [
         ffmpeg_bin(),
         "-y",
+        *_HWACCEL,
         "-i", input_path,
-        "-vf", "scale=-2:1080:flags=lanczos",
-        "-c:v", "libx264",
-        "-pix_fmt", "yuv420p",
-        "-preset", "slow",
-        "-crf", "18",
-        "-c:a", "aac",
-        "-b:a", "192k",
+        *_VF_1080,
+        *_select_encoder(),
+        *_AAC_192K,
         output_path,
     ]
-    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _run_ffmpeg(cmd)
+
+
+def probe_video(input_path: str) -> dict:
+    """Return width, height, frame rates and duration of the first video stream via ffprobe."""
+    cmd = [
+        ffprobe_bin(),
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,r_frame_rate,avg_frame_rate:format=duration",
+        "-of", "json",
+        input_path,
+    ]
+    res = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    data = json.loads(res.stdout.decode(errors="ignore") or "{}")
+    stream = (data.get("streams") or [{}])[0]
+    return {
+        "width": int(stream.get("width") or 0),
+        "height": int(stream.get("height") or 0),
+        "r_frame_rate": stream.get("r_frame_rate", ""),
+        "avg_frame_rate": stream.get("avg_frame_rate", ""),
+        "duration": float((data.get("format") or {}).get("duration") or 0.0),
+    }
+
+
+def keyframe_times(input_path: str) -> list:
+    """Return sorted keyframe timestamps (seconds) of the first video stream.
+
+    Reads packet flags only, so nothing is decoded.
+    """
+    cmd = [
+        ffprobe_bin(),
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0",
+        input_path,
+    ]
+    res = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    times = []
+    for line in res.stdout.decode(errors="ignore").splitlines():
+        pts, _, flags = line.partition(",")
+        if "K" in flags:
+            try:
+                times.append(float(pts))
+            except ValueError:
+                continue
+    return sorted(times)
+
+
+def _grid_frames(t: float, fps: int) -> int:
+    """Frames of an fps grid starting at 0 that fall before time t (rounded to nearest)."""
+    return int(t * fps + 0.5)
+
+
+def _keyframe_segments(input_path: str, workers: int, fps: int = 30) -> list:
+    """Split a long constant-frame-rate video into up to `workers` keyframe-aligned
+    (start, duration, frames) segments. Returns [] when linear extraction should be used.
+
+    `frames` is the segment's share of the global fps grid, so capping each
+    segment at it keeps the fps filter (which restarts per process) from
+    emitting boundary duplicates.
+    """
+    try:
+        info = probe_video(input_path)
+        if info["r_frame_rate"] != info["avg_frame_rate"]:
+            return []  # VFR: segment frame counts aren't predictable
+        duration = info["duration"]
+        if duration < PARALLEL_EXTRACT_MIN_SECONDS:
+            return []
+        keys = keyframe_times(input_path)
+    except Exception:
+        return []
+    # First keyframe at/after each even split point
+    starts = [0.0]
+    for k in range(1, workers):
+        target = duration * k / workers
+        nxt = next((t for t in keys if t >= target), None)
+        if nxt is not None and nxt > starts[-1] and nxt < duration:
+            starts.append(nxt)
+    if len(starts) < 2:
+        return []
+    ends = starts[1:] + [duration]
+    return [
+        (s, (e - s) if e != duration else None, _grid_frames(e, fps) - _grid_frames(s, fps))
+        for s, e in zip(starts, ends)
+    ]
+
+
+def _extract_frames_cmd(input_path: str, pattern: str, fps: int, start: float | None = None, duration: float | None = None, frames: int | None = None) -> list:
+    cmd = [ffmpeg_bin(), "-y"]
+    if start:
+        cmd += ["-ss", f"{start:.6f}"]
+    cmd += [*_HWACCEL, "-i", input_path]
+    if duration is not None:
+        cmd += ["-t", f"{duration:.6f}"]
+    cmd += ["-vf", f"fps={fps}"]
+    if frames is not None:
+        cmd += ["-frames:v", str(frames)]
+    cmd += [
+        "-pix_fmt", "rgb24",
+        "-compression_level", "1",
+        pattern,
+    ]
+    return cmd
 
 
 def extract_frames(input_path: str, frames_dir: str, fps: int = 30) -> str:
-    """Extract frames to frames_dir as frames_%06d.png. Returns pattern path."""
+    """Extract frames to frames_dir as frames_%06d.png. Returns pattern path.
+
+    Frames are written as 8-bit RGB PNGs with the fastest zlib level: they are
+    intermediates, so encode/decode speed matters more than file size.
+    Long constant-frame-rate videos are split at keyframes and the segments are
+    decoded by parallel ffmpeg processes, each capped at its share of the
+    global fps grid, then renumbered into one sequence. VFR or short sources,
+    any segment failure, or a total that doesn't match the grid use a single
+    linear decode.
+    """
     Path(frames_dir).mkdir(parents=True, exist_ok=True)
     pattern = str(Path(frames_dir) / "frames_%06d.png")
+    workers = min(4, os.cpu_count() or 1)
+    segments = _keyframe_segments(input_path, workers, fps) if workers > 1 else []
+    if segments:
+        seg_dirs = [Path(frames_dir) / f"seg_{k:02d}" for k in range(len(segments))]
+        try:
+            for d in seg_dirs:
+                d.mkdir(parents=True, exist_ok=True)
+            with ThreadPoolExecutor(max_workers=len(segments)) as pool:
+                futures = [
+                    pool.submit(_run_ffmpeg, _extract_frames_cmd(input_path, str(d / "frames_%06d.png"), fps, start, dur, count))
+                    for d, (start, dur, count) in zip(seg_dirs, segments)
+                ]
+                for fut in futures:
+                    fut.result()
+            seg_names = [sorted(os.listdir(d)) for d in seg_dirs]
+            if sum(map(len, seg_names)) != sum(count for _, _, count in segments):
+                raise RuntimeError("segmented extraction frame count mismatch")
+            # Renumber segment outputs into one contiguous sequence
+            n = 0
+            for d, names in zip(seg_dirs, seg_names):
+                for name in names:
+                    n += 1
+                    os.replace(d / name, Path(frames_dir) / f"frames_{n:06d}.png")
+            return pattern
+        except Exception:
+            # Fall through to linear extraction from a clean directory
+            for f in Path(frames_dir).glob("frames_*.png"):
+                f.unlink()
+        finally:
+            for d in seg_dirs:
+                shutil.rmtree(d, ignore_errors=True)
+    cmd = _extract_frames_cmd(input_path, pattern, fps)
+    _run_ffmpeg(cmd)
+    return pattern
+
+
+_staging_reserved: dict[str, int] = {}
+_staging_lock = threading.Lock()
+
+
+def frames_staging_dir(job_id: str, input_path: str, scale: int, fallback: Path, fps: int = 30) -> Path:
+    """Return the directory a job's frame sequences should live in.
+
+    FRAMES_STAGING_DIR/<job_id> when that filesystem has free space for the
+    job's input and upscaled frames (estimated as raw RGB, which PNG never
+    exceeds) after what running jobs have already reserved, otherwise
+    `fallback` (the on-disk work dir). A staged job's estimate stays reserved
+    until release_staging(job_id).
+    """
+    try:
+        info = probe_video(input_path)
+        need = int(info["duration"] * fps) * info["width"] * info["height"] * 3 * (1 + scale * scale)
+        if not need:
+            return fallback
+        FRAMES_STAGING_DIR.mkdir(parents=True, exist_ok=True)
+        with _staging_lock:
+            free = shutil.disk_usage(FRAMES_STAGING_DIR).free - sum(_staging_reserved.values())
+            if free < need:
+                return fallback
+            _staging_reserved[job_id] = need
+        stage = FRAMES_STAGING_DIR / job_id
+        stage.mkdir(parents=True, exist_ok=True)
+        return stage
+    except Exception:
+        release_staging(job_id)
+        return fallback
+
+
+def release_staging(job_id: str) -> None:
+    """Drop the staging space reserved for job_id (no-op if none)."""
+    with _staging_lock:
+        _staging_reserved.pop(job_id, None)
+
+
+def _popen_logged(cmd: list, **kwargs) -> subprocess.Popen:
+    """Popen with stderr spooled to an anonymous temp file (see proc_stderr).
+
+    A pipe nobody reads fills at ~64 KB and blocks ffmpeg, which would hang
+    the caller's stdout/stdin loop on a noisy (e.g. damaged) input.
+    """
+    log = tempfile.TemporaryFile()
+    try:
+        proc = subprocess.Popen(cmd, stderr=log, **kwargs)
+    except Exception:
+        log.close()
+        raise
+    proc.stderr_log = log
+    return proc
+
+
+def proc_stderr(proc: subprocess.Popen, limit: int = 240) -> str:
+    """Return the last `limit` chars of stderr captured by _popen_logged."""
+    log = getattr(proc, "stderr_log", None)
+    if log is None or log.closed:
+        return ""
+    log.seek(0)
+    return log.read().decode(errors="ignore").strip()[-limit:]
+
+
+def open_raw_reader(input_path: str, fps: int = 30) -> subprocess.Popen:
+    """Start ffmpeg decoding input_path to raw BGR24 frames on stdout."""
     cmd = [
         ffmpeg_bin(),
-        "-y",
+        *_FFMPEG_QUIET,
+        *_HWACCEL,
         "-i", input_path,
         "-vf", f"fps={fps}",
-        pattern,
+        "-f", "rawvideo",
+        "-pix_fmt", "bgr24",
+        "-",
     ]
-    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    return pattern
+    return _popen_logged(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+
+
+def open_raw_writer(width: int, height: int, output_path: str, audio_source: str | None = None, fps: int = 30) -> subprocess.Popen:
+    """Start ffmpeg encoding raw BGR24 frames from stdin into a 2160p MP4.
+
+    Audio, if any, is taken straight from audio_source (typically the original
+    upload); a source without an audio stream yields a silent video.
+    """
+    cmd = [
+        ffmpeg_bin(),
+        "-y",
+        *_FFMPEG_QUIET,
+        "-f", "rawvideo",
+        "-pix_fmt", "bgr24",
+        "-s", f"{width}x{height}",
+        "-framerate", str(fps),
+        "-i", "-",
+    ]
+    if audio_source:
+        cmd += ["-i", audio_source, "-map", "0:v:0", "-map", "1:a:0?", *_AAC_192K, "-shortest"]
+    # scale=-2:2160 output width (ultra-wide sources exceed hardware encoder limits)
+    out_width = 2160 * width // max(1, height)
+    cmd += [
+        *_VF_2160,
+        *_select_encoder(out_width),
+        output_path,
+    ]
+    return _popen_logged(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
 
 
 def extract_audio(input_path: str, audio_out: str) -> None:
@@ -612,12 +1512,8 @@ def extract_audio(input_path: str, audio_out: str) -> None:
         "-b:a", "192k",
         audio_out,
     ]
-    try:
-        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except subprocess.CalledProcessError as e:
-        err = e.stderr.decode(errors="ignore") if e.stderr else ""
-        # Common case: source has no audio stream; let caller decide to proceed without audio
-        raise RuntimeError((err[:240] + ("…" if len(err) > 240 else "")) or "ffmpeg extract_audio failed") from e
+    # Common case: source has no audio stream; the RuntimeError lets the caller proceed without audio
+    _run_ffmpeg(cmd, "ffmpeg extract_audio")
 
 
 def combine_frames_audio(frames_pattern: str, audio_path: str, output_path: str, fps: int = 30) -> None:
@@ -628,10 +1524,9 @@ def combine_frames_audio(frames_pattern: str, audio_path: str, output_path: str,
         "-framerate", str(fps),
         "-i", frames_pattern,
         "-i", audio_path,
-        "-c:v", "libx264",
-        "-pix_fmt", "yuv420p",
+        *_X264_DEFAULT,
         "-c:a", "aac",
         "-shortest",
         output_path,
     ]
-    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _run_ffmpeg(cmd)
@@ -1,38 +1,149 @@
 import asyncio
 import os
+import re
 import shutil
+import threading
 import time
 from pathlib import Path
 from typing import Dict, Optional, Tuple
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 
-from . import utils
+from . import esrgan_torch, utils
+from .jobs import JobState
 
+# Output scale per model value; unknown names fall back to an "x<N>" suffix, else 4x
+MODEL_SCALE: Dict[str, int] = {
+    "general": 4,
+    "face": 4,
+    "anime": 4,
+    "realesrgan-x4plus": 4,
+    "realesrgan-x4plus-face": 4,
+    "realesrgan-x4plus-anime": 4,
+    "realesr-general-x4v3": 4,
+    "realesr-animevideov3-x2": 2,
+    "realesr-animevideov3-x3": 3,
+    "realesr-animevideov3-x4": 4,
+}
+_SCALE_RE = re.compile(r"x([234])")
 
-async def process_job(job_id: str, store: Dict[str, dict]) -> None:
+
+def model_scale(model: str) -> int:
+    m = (model or "").strip().lower()
+    scale = MODEL_SCALE.get(m)
+    if scale is None:
+        found = _SCALE_RE.search(m)
+        scale = int(found.group(1)) if found else 4
+    return scale
+
+
+# In-flight Real-ESRGAN frames per GPU id; new work goes to the least-loaded
+# device so a second GPU is used even when no retries fire. utils falls back
+# to other ids / auto if a device doesn't exist.
+GPU_IDS = (0, 1)
+_gpu_load = [0] * len(GPU_IDS)
+_gpu_lock = threading.Lock()
+
+
+def _acquire_gpu(weight: int = 1, exclude: Tuple[int, ...] = ()) -> int:
+    """Reserve the least-loaded GPU (avoiding `exclude` when possible) and return its id."""
+    with _gpu_lock:
+        slots = [k for k, g in enumerate(GPU_IDS) if g not in exclude] or list(range(len(GPU_IDS)))
+        k = min(slots, key=_gpu_load.__getitem__)
+        _gpu_load[k] += weight
+        return GPU_IDS[k]
+
+
+def _release_gpu(gpu_id: int, weight: int = 1) -> None:
+    with _gpu_lock:
+        _gpu_load[GPU_IDS.index(gpu_id)] -= weight
+
+
+def _acquire_all_gpus(weight: int = 1) -> str:
+    """Add `weight` to every GPU's load and return them as an ncnn -g list ("0,1")."""
+    with _gpu_lock:
+        for k in range(len(GPU_IDS)):
+            _gpu_load[k] += weight
+    return ",".join(map(str, GPU_IDS))
+
+
+def _release_all_gpus(weight: int = 1) -> None:
+    with _gpu_lock:
+        for k in range(len(GPU_IDS)):
+            _gpu_load[k] -= weight
+
+
+# ensure_* results are cached for the process lifetime; one lock per tool so
+# concurrent jobs probe each tool once while different tools still run in parallel
+_ensured: Dict[str, bool] = {"ffmpeg": False, "esrgan": False, "gfpgan": False}
+_ensure_locks: Dict[str, asyncio.Lock] = {name: asyncio.Lock() for name in _ensured}
+
+
+async def _ensure(name: str, fn) -> None:
+    if _ensured[name]:
+        return
+    async with _ensure_locks[name]:
+        if not _ensured[name]:
+            await asyncio.get_running_loop().run_in_executor(None, fn)
+            _ensured[name] = True
+
+
+# Minimum seconds between job progress writes (4 Hz) during per-frame loops
+PROGRESS_INTERVAL = 0.25
+
+# Per-frame work queue shared by every running job. A fixed set of worker tasks
+# pops frames on demand, so concurrent jobs interleave and a canceled job's
+# queued frames are skipped instead of processed.
+FRAME_WORKERS = min(max(2, (os.cpu_count() or 4) // 2), 8)
+# Long-lived thread pools reused across jobs (threads stay warm between jobs)
+ESRGAN_POOL = ThreadPoolExecutor(max_workers=FRAME_WORKERS, thread_name_prefix="esr")
+FACE_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="face")
+_frame_q: Optional[asyncio.Queue] = None
+_frame_worker_tasks: set = set()
+
+
+async def _frame_worker(q: asyncio.Queue) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        fn, item, fut = await q.get()
+        try:
+            # Future already canceled (job canceled) -> skip without running
+            if not fut.done():
+                res = await loop.run_in_executor(ESRGAN_POOL, fn, item)
+                if not fut.done():
+                    fut.set_result(res)
+        except Exception as e:
+            if not fut.done():
+                fut.set_exception(e)
+        finally:
+            q.task_done()
+
+
+def _frame_queue() -> asyncio.Queue:
+    """Return the shared frame queue, starting its workers on first use."""
+    global _frame_q
+    if _frame_q is None:
+        _frame_q = asyncio.Queue(maxsize=2 * FRAME_WORKERS)
+        for _ in range(FRAME_WORKERS):
+            _frame_worker_tasks.add(asyncio.create_task(_frame_worker(_frame_q)))
+    return _frame_q
+
+
+async def process_job(job_id: str, store: Dict[str, JobState]) -> None:
     job = store.get(job_id)
     if not job:
         return
 
-    src = job.get("uploadPath")
+    src = job.upload_path
     if not src or not os.path.exists(src):
-        job["status"] = "failed"
-        job["progress"] = 0
+        job.update(status="failed", progress=0)
         return
 
     # Begin processing
-    job["status"] = "processing"
-    model = job.get("model", "realesrgan-x4plus")
+    job.update(status="processing")
+    model = job.model
     # Derive ESRGAN scale from model name
-    scale = 4
-    if "x4plus" in model or "face" in model or "anime" in model:
-        scale = 4
-    elif "x3" in model:
-        scale = 3
-    elif "x2" in model:
-        scale = 2
-    job["message"] = f"Preparing… (model: {model})"
-    job["progress"] = 5
+    scale = model_scale(model)
+    job.update(message=f"Preparing… (model: {model})", progress=5)
 
     # Prepare final output path using requested timestamped naming
     orig_name = Path(src).name
@@ -40,157 +151,342 @@ async def process_job(job_id: str, store: Dict[str, dict]) -> None:
 
     # Working directory for intermediate artifacts
     work_dir = Path(utils.RESULTS_DIR) / f"{job_id}_work"
+    # Frame sequences may move to RAM-backed staging once the source is probed
+    stage_dir = work_dir
     frames_dir = work_dir / "frames"
     enhanced_dir = work_dir / "enhanced"
-    faces_dir = work_dir / "enhanced_faces"
     audio_path = work_dir / "audio.m4a"
+    log_path = ""  # set once prepare_job_dirs has created logs/
+    audio_task: Optional[asyncio.Future] = None
     try:
-        work_dir.mkdir(parents=True, exist_ok=True)
+        dirs = utils.prepare_job_dirs(job_id)
+        log_path = str(dirs["logs"] / "frame_enhance.log")
 
         # Ensure ffmpeg available (local auto-download on Windows)
         loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, utils.ensure_ffmpeg)
+        await _ensure("ffmpeg", utils.ensure_ffmpeg)
+
+        # Fused stream mode: ffmpeg decode -> PyTorch Real-ESRGAN -> ffmpeg encode over pipes.
+        # Only when it covers every stage: without PyTorch GFPGAN weights, an installed
+        # ncnn GFPGAN still needs frame files.
+        stream = utils.STREAM_MODE and await loop.run_in_executor(None, esrgan_torch.available, model)
+        faces = stream and await loop.run_in_executor(None, esrgan_torch.faces_available, model)
+        if stream and (faces or not os.path.exists(utils.GFPGAN_EXE)):
+            job.update(message=f"Enhancing frames… (model: {model}, scale: {scale}x)", progress=20)
+            start_ts = time.time()
+            last_report = 0.0
+
+            def report_stream(done_count: int, expected: int) -> None:
+                nonlocal last_report
+                now = time.monotonic()
+                if now - last_report < PROGRESS_INTERVAL:
+                    return
+                last_report = now
+                elapsed = max(0.001, time.time() - start_ts)
+                job.update(
+                    processed_frames=done_count,
+                    total_frames=expected,
+                    avg_ms_per_frame=int((elapsed * 1000.0) / done_count),
+                    progress=min(90, 20 + int(70 * done_count / expected)),
+                    message=f"Enhancing with AI… {done_count}/{expected}",
+                )
+
+            try:
+                await loop.run_in_executor(
+                    None,
+                    lambda: esrgan_torch.stream_video(
+                        str(src), out_abs, model, scale, faces=faces,
+                        on_frame=report_stream, should_stop=lambda: job.canceled,
+                    ),
+                )
+                job.update(status="completed", message="Completed", progress=100, result_path=out_abs, result_url=public_url)
+                return
+            except Exception as se:
+                # Never leave a partial result in the publicly served results dir
+                try:
+                    os.unlink(out_abs)
+                except OSError:
+                    pass
+                if job.canceled:
+                    job.update(status="canceled", message="Canceled by user"); return
+                job.update(message=f"Stream mode failed: {se}. Using frame files", progress=20)
+
+        # Audio has no dependency on the frame stages; extract it from the ORIGINAL in the background
+        audio_task = loop.run_in_executor(None, utils.extract_audio, str(src), str(audio_path))
 
         # 1) Extract frames from ORIGINAL video for best quality (not from a downscaled intermediate)
-        if job.get("canceled"):
-            job["status"] = "canceled"; job["message"] = "Canceled by user"; return
-        job["message"] = "Extracting frames…"; job["progress"] = 20
-        frames_pattern = await loop.run_in_executor(None, utils.extract_frames, str(src), str(frames_dir), 30)
+        if job.canceled:
+            job.update(status="canceled", message="Canceled by user"); return
+        job.update(message="Extracting frames…", progress=20)
+        stage_dir = await loop.run_in_executor(None, utils.frames_staging_dir, job_id, str(src), scale, work_dir)
+        dirs = utils.prepare_job_dirs(job_id, stage_dir)
+        frames_dir, enhanced_dir = dirs["frames"], dirs["enhanced"]
+        try:
+            frames_pattern = await loop.run_in_executor(None, utils.extract_frames, str(src), str(frames_dir), 30)
+        except (OSError, RuntimeError) as se:
+            if stage_dir == work_dir:
+                raise
+            # Staging filled up (ENOSPC from us or ffmpeg) despite the estimate: redo it on disk
+            utils.write_log(log_path, f"staging_fail err={se}")
+            shutil.rmtree(stage_dir, ignore_errors=True)
+            utils.release_staging(job_id)
+            stage_dir = work_dir
+            dirs = utils.prepare_job_dirs(job_id)
+            frames_dir, enhanced_dir = dirs["frames"], dirs["enhanced"]
+            frames_pattern = await loop.run_in_executor(None, utils.extract_frames, str(src), str(frames_dir), 30)
 
         # 3) Enhance frames via Real-ESRGAN (ncnn-vulkan) with graceful fallback
-        if job.get("canceled"):
-            job["status"] = "canceled"; job["message"] = "Canceled by user"; return
-        job["message"] = f"Preparing Real-ESRGAN… (model: {model})"; job["progress"] = 45
-        await loop.run_in_executor(None, utils.ensure_realesrgan)
+        if job.canceled:
+            job.update(status="canceled", message="Canceled by user"); return
+        job.update(message=f"Preparing Real-ESRGAN… (model: {model})", progress=45)
+        # Probe Real-ESRGAN and GFPGAN concurrently; only a Real-ESRGAN failure is fatal here
+        esr_res, gfp_res = await asyncio.gather(
+            _ensure("esrgan", utils.ensure_realesrgan),
+            _ensure("gfpgan", utils.ensure_gfpgan),
+            return_exceptions=True,
+        )
+        if isinstance(esr_res, BaseException):
+            raise esr_res
+        gfpgan_ready = not isinstance(gfp_res, BaseException)
 
         try:
-            job["message"] = f"Enhancing frames… (model: {model}, scale: {scale}x)"; job["progress"] = 50
-            enhanced_dir.mkdir(parents=True, exist_ok=True)
-            frames = sorted(frames_dir.glob("frames_*.png"))
-            # Pre-check frames exist and are readable (non-zero)
+            job.update(message=f"Enhancing frames… (model: {model}, scale: {scale}x)", progress=50)
+            # Single scandir pass; zero-sized frames (rare) are dropped
+            frames = utils.list_frames(str(frames_dir), "frames_")
             if not frames:
-                raise RuntimeError("No frames extracted")
-            # Drop zero-sized frames if any (rare)
-            frames = [p for p in frames if p.exists() and p.stat().st_size > 0]
-            if not frames:
-                raise RuntimeError("No valid frames to enhance")
+                raise RuntimeError("No valid frames extracted")
             total = len(frames)
-            job["totalFrames"] = total
-            job["processedFrames"] = 0
-            log_path = str(work_dir / "logs" / "frame_enhance.log")
+            job.update(total_frames=total, processed_frames=0)
+
+            # Reusable buffers at the enhanced resolution for source-frame fallback fills
+            frame_pool = None
+            in_shape = utils.probe_frame_shape(str(frames[0]))
+            if in_shape:
+                from .frame_pool import FramePool
+                frame_pool = FramePool((in_shape[0] * scale, in_shape[1] * scale, 3), size=FRAME_WORKERS)
 
-            # Parallel enhancement with retries and GPU round-robin
-            max_workers = min(max(2, (os.cpu_count() or 4) // 2), 8)
-            gpu_pool = [0, 1]  # try balancing if multiple GPUs exist; utils will fallback if not
+            def fill_from_input(in_path: Path, out_path: Path) -> None:
+                if frame_pool is not None:
+                    utils.copy_frame_buf(frame_pool, str(in_path), str(out_path))
+                else:
+                    utils.copy_frame(str(in_path), str(out_path))
 
+            # Per-frame fallback: queued enhancement with retries on the least-loaded GPU
             def enhance_one(idx_path: Tuple[int, Path]) -> int:
                 i, in_path = idx_path
                 out_path = enhanced_dir / f"enhanced_{i:06d}.png"
-                # Quick input validation
-                if not utils.is_image_nonblack(str(in_path)):
-                    utils.write_log(log_path, f"input_black frame={i} path={in_path}")
                 # Up to 3 attempts (2 retries)
                 attempts = 0
                 last_err: Optional[Exception] = None
+                failed_gpus: Tuple[int, ...] = ()
                 while attempts < 3:
+                    # Retries avoid devices that already failed this frame
+                    gpu_choice = _acquire_gpu(exclude=failed_gpus)
                     try:
-                        gpu_choice = gpu_pool[attempts % len(gpu_pool)] if gpu_pool else None
-                        utils.run_realesrgan_frame(str(in_path), str(out_path), model=model, scale=scale, gpu_id=str(gpu_choice) if gpu_choice is not None else None)
-                        # Validate output not black
+                        utils.run_realesrgan_frame(str(in_path), str(out_path), model=model, scale=scale, gpu_id=str(gpu_choice))
+                        # Verify inline (cv2 countNonZero) so a black output is retried here, not patched later
                         if not utils.is_image_nonblack(str(out_path)):
                             raise RuntimeError("output_black")
                         return i
                     except Exception as e:
                         last_err = e
                         attempts += 1
+                        failed_gpus += (gpu_choice,)
+                    finally:
+                        _release_gpu(gpu_choice)
                 # Final fallback: copy input frame (may be corrected in post-fix)
                 utils.write_log(log_path, f"enhance_fail_final frame={i} err={last_err}")
-                utils.copy_frame(str(in_path), str(out_path))
+                fill_from_input(in_path, out_path)
                 return i
 
             indexed = [(idx + 1, p) for idx, p in enumerate(frames)]
-            done_count = 0
             start_ts = time.time()
-            with ThreadPoolExecutor(max_workers=max_workers) as pool:
-                futures = [pool.submit(enhance_one, ip) for ip in indexed]
-                for fut in as_completed(futures):
-                    if job.get("canceled"):
-                        job["status"] = "canceled"; job["message"] = "Canceled by user"; return
-                    _ = fut.result()  # raise if any thread error surfaced
-                    done_count += 1
-                    job["processedFrames"] = done_count
-                    # Update average ms per frame for ETA
-                    elapsed = max(0.001, time.time() - start_ts)
-                    job["avgMsPerFrame"] = int((elapsed * 1000.0) / max(1, done_count))
-                    # Map progress 50% -> 80% based on frames completed
-                    pct = 50 + int(30 * (done_count / total))
-                    job["progress"] = min(80, pct)
-                    job["message"] = f"Enhancing with AI… {done_count}/{total}"
-
-            # Post-fix pass to guarantee non-black and ordered outputs
-            last_good: Optional[Path] = None
-            for i in range(1, total + 1):
+            last_report = 0.0
+
+            def report_progress(done_count: int, label: str = "Enhancing with AI…") -> None:
+                # Throttle to PROGRESS_INTERVAL; the final count is always written
+                nonlocal last_report
+                now = time.monotonic()
+                if done_count < total and now - last_report < PROGRESS_INTERVAL:
+                    return
+                last_report = now
+                # Average ms per frame for ETA; progress maps 50% -> 80% on frames completed
+                elapsed = max(0.001, time.time() - start_ts)
+                pct = 50 + int(30 * (done_count / total))
+                job.update(
+                    processed_frames=done_count,
+                    avg_ms_per_frame=int((elapsed * 1000.0) / max(1, done_count)),
+                    progress=min(80, pct),
+                    message=f"{label} {done_count}/{total}",
+                )
+
+            async def poll_batch_progress(prefix: str) -> None:
+                while True:
+                    await asyncio.sleep(0.5)
+                    produced = utils.count_frames(str(enhanced_dir), prefix)
+                    if produced:
+                        report_progress(min(produced, total))
+
+            # Batched PyTorch fp16 inference when CUDA + weights are available, otherwise a
+            # single Real-ESRGAN (ncnn-vulkan) invocation over the whole frames dir
+            torch_backend = await loop.run_in_executor(None, esrgan_torch.available, model)
+            # GFPGAN with Real-ESRGAN as its background upsampler: faces + upscale in one pass
+            torch_faces = torch_backend and await loop.run_in_executor(None, esrgan_torch.faces_available, model)
+            poller = asyncio.create_task(poll_batch_progress("enhanced_" if torch_backend else "frames_"))
+            # Set only once the fused GFPGAN pass has actually produced the frames
+            faces_done = False
+
+            async def run_ncnn_dir() -> None:
+                # One ncnn process spread over every GPU; each carries its share of the load
+                share = max(1, total // len(GPU_IDS))
+                gpus = _acquire_all_gpus(weight=share)
+                try:
+                    await loop.run_in_executor(
+                        None,
+                        lambda: utils.run_realesrgan_dir(
+                            str(frames_dir), str(enhanced_dir), model, scale, gpus,
+                            should_stop=lambda: job.canceled,
+                        ),
+                    )
+                finally:
+                    _release_all_gpus(weight=share)
+
+            try:
+                if torch_backend:
+                    pairs = [(p, enhanced_dir / f"enhanced_{i:06d}.png") for i, p in indexed]
+                    run = esrgan_torch.restore_frames if torch_faces else esrgan_torch.enhance_frames
+                    try:
+                        await loop.run_in_executor(None, run, pairs, model, scale, lambda: job.canceled)
+                        faces_done = torch_faces
+                    except Exception as te:
+                        if job.canceled:
+                            job.update(status="canceled", message="Canceled by user"); return
+                        # Still one ncnn process for the whole dir, not one per frame
+                        utils.write_log(log_path, f"torch_fail err={te}")
+                        poller.cancel()
+                        poller = asyncio.create_task(poll_batch_progress("frames_"))
+                        await run_ncnn_dir()
+                else:
+                    await run_ncnn_dir()
+            except Exception as be:
+                utils.write_log(log_path, f"batch_fail err={be}")
+            finally:
+                poller.cancel()
+            if job.canceled:
+                job.update(status="canceled", message="Canceled by user"); return
+
+            # ncnn batch outputs keep input names; move them into the enhanced_%06d sequence
+            missing = []
+            for i, in_path in indexed:
                 out_path = enhanced_dir / f"enhanced_{i:06d}.png"
-                in_path = frames_dir / f"frames_{i:06d}.png"
-                if not out_path.exists() or not utils.is_image_nonblack(str(out_path)):
-                    if last_good and last_good.exists():
-                        utils.copy_frame(str(last_good), str(out_path))
-                    else:
-                        # Use input as last resort
-                        utils.copy_frame(str(in_path), str(out_path))
-                if utils.is_image_nonblack(str(out_path)):
-                    last_good = out_path
-
-            # 4) Optional face enhancement via GFPGAN over ESRGAN frames
-            use_faces = False
+                produced = enhanced_dir / in_path.name
+                if produced.exists():
+                    os.replace(produced, out_path)
+                elif not out_path.exists():
+                    missing.append((i, in_path))
+            report_progress(total - len(missing))
+
+            # Per-frame retry path only for frames the batch run did not produce
+            if missing:
+                done_count = total - len(missing)
+                futures = [loop.create_future() for _ in missing]
+
+                async def produce() -> None:
+                    q = _frame_queue()
+                    for ip, fut in zip(missing, futures):
+                        if job.canceled:
+                            # Resolve the rest as canceled so the consumer loop wakes up
+                            for rest in futures:
+                                rest.cancel()
+                            break
+                        await q.put((enhance_one, ip, fut))
+
+                producer = asyncio.create_task(produce())
+                try:
+                    for next_done in asyncio.as_completed(futures):
+                        if job.canceled:
+                            next_done.close()
+                            job.update(status="canceled", message="Canceled by user"); return
+                        await next_done  # raise if any worker error surfaced
+                        done_count += 1
+                        report_progress(done_count, "Retrying frames…")
+                finally:
+                    # Stop feeding and drop this job's queued frames (workers skip canceled futures)
+                    producer.cancel()
+                    for fut in futures:
+                        fut.cancel()
+
+            # Post-fix: validate all outputs in one batched pass, then patch only bad frames
+            out_paths = [enhanced_dir / f"enhanced_{i:06d}.png" for i, _ in indexed]
+            bad = await loop.run_in_executor(None, utils.validate_frames_batch, out_paths)
+            last_good = -1
+            for pos in sorted(bad):
+                # Reuse the nearest previous good output; fall back to the input frame
+                if pos - 1 not in bad:
+                    last_good = pos - 1
+                src_frame = out_paths[last_good] if last_good >= 0 else indexed[pos][1]
+                utils.write_log(log_path, f"output_black frame={pos + 1} fill={src_frame.name}")
+                if last_good >= 0:
+                    utils.copy_frame(str(src_frame), str(out_paths[pos]))
+                else:
+                    fill_from_input(src_frame, out_paths[pos])
+
+            # Source frames are fully consumed; drop them so only one PNG sequence sits on disk
+            await loop.run_in_executor(None, shutil.rmtree, frames_dir, True)
+
+            # 4) Optional face enhancement via GFPGAN (ncnn) over ESRGAN frames that the fused
+            # PyTorch pass did not restore (all of them, unless it succeeded). Frames are
+            # rewritten in place, so the encoder always reads the enhanced_%06d sequence.
+            face_paths = [enhanced_dir / f"enhanced_{i:06d}.png" for i, _ in missing] if faces_done else out_paths
             try:
-                job["message"] = "Enhancing faces (GFPGAN)…"; job["progress"] = 72
-                await loop.run_in_executor(None, utils.ensure_gfpgan)
-                if os.path.exists(utils.GFPGAN_EXE):
-                    faces_dir.mkdir(parents=True, exist_ok=True)
-                    esr_frames = sorted(enhanced_dir.glob("enhanced_*.png"))
-                    total_f = max(1, len(esr_frames))
-
-                    def run_face(idx_path):
-                        idx, path = idx_path
-                        out_path = faces_dir / f"faces_{idx:06d}.png"
-                        utils.run_gfpgan_frame(str(path), str(out_path))
-                        return idx
-
-                    with ThreadPoolExecutor(max_workers=2) as pool:
-                        futures = [pool.submit(run_face, (i+1, p)) for i, p in enumerate(esr_frames)]
+                if face_paths and gfpgan_ready and os.path.exists(utils.GFPGAN_EXE):
+                    job.update(message="Enhancing faces (GFPGAN)…", progress=72)
+                    total_f = max(1, len(face_paths))
+
+                    def run_face(path: Path) -> None:
+                        tmp_path = path.with_name(f"faces_tmp_{path.name}")
+                        utils.run_gfpgan_frame(str(path), str(tmp_path))
+                        os.replace(tmp_path, path)
+
+                    # This job's futures on the shared pool; canceling the set drops its queued frames
+                    face_futures = [asyncio.wrap_future(FACE_POOL.submit(run_face, p)) for p in face_paths]
+                    try:
                         donef = 0
-                        for fut in as_completed(futures):
-                            if job.get("canceled"):
-                                job["status"] = "canceled"; job["message"] = "Canceled by user"; return
-                            fut.result()
+                        last_face_report = 0.0
+                        for next_done in asyncio.as_completed(face_futures):
+                            if job.canceled:
+                                next_done.close()
+                                job.update(status="canceled", message="Canceled by user"); return
+                            await next_done
                             donef += 1
+                            now = time.monotonic()
+                            if donef < total_f and now - last_face_report < PROGRESS_INTERVAL:
+                                continue
+                            last_face_report = now
                             pct = 72 + int(6 * (donef / total_f))
-                            job["progress"] = min(78, pct)
-                            job["message"] = f"Enhancing faces (GFPGAN)… {donef}/{total_f}"
-                    use_faces = True
+                            job.update(progress=min(78, pct), message=f"Enhancing faces (GFPGAN)… {donef}/{total_f}")
+                    finally:
+                        for fut in face_futures:
+                            fut.cancel()
             except Exception:
-                # Skip GFPGAN on any error
-                use_faces = False
+                # Skip GFPGAN on any error; frames not yet processed keep their ESRGAN output
+                pass
 
-            # 5) Extract audio from ORIGINAL (handle errors locally; proceed video-only if needed)
-            if job.get("canceled"):
-                job["status"] = "canceled"; job["message"] = "Canceled by user"; return
-            job["message"] = "Extracting audio…"; job["progress"] = 70
+            # 5) Collect background audio extraction (handle errors locally; proceed video-only if needed)
+            if job.canceled:
+                job.update(status="canceled", message="Canceled by user"); return
             audio_ok = True
             try:
-                await loop.run_in_executor(None, utils.extract_audio, str(src), str(audio_path))
+                await audio_task
             except Exception as ae:
                 audio_ok = False
-                job["message"] = f"Audio unavailable: {ae}. Continuing without audio"
-
-            # 6) Combine enhanced frames (or face-enhanced) + audio (or silent)
-            if job.get("canceled"):
-                job["status"] = "canceled"; job["message"] = "Canceled by user"; return
-            job["message"] = "Encoding final 4K video…"; job["progress"] = 92
-            pattern_dir = faces_dir if use_faces else enhanced_dir
-            name_prefix = "faces" if use_faces else "enhanced"
-            enhanced_pattern = str(pattern_dir / f"{name_prefix}_%06d.png")
+                job.update(message=f"Audio unavailable: {ae}. Continuing without audio")
+
+            # 6) Combine enhanced (possibly face-restored) frames + audio (or silent)
+            if job.canceled:
+                job.update(status="canceled", message="Canceled by user"); return
+            job.update(message="Encoding final 4K video…", progress=92)
+            enhanced_pattern = str(enhanced_dir / "enhanced_%06d.png")
             try:
                 if audio_ok:
                     await loop.run_in_executor(None, utils.combine_frames_audio_2160p, enhanced_pattern, str(audio_path), out_abs, 30)
@@ -202,26 +498,29 @@ async def process_job(job_id: str, store: Dict[str, dict]) -> None:
         except Exception as e:
             # Graceful fallback: include precise ESRGAN error in job message for diagnosis
             detail = str(e)
-            job["message"] = f"Real-ESRGAN failed: {detail}. Falling back to 4K upscale"
-            job["progress"] = 95
+            job.update(message=f"Real-ESRGAN failed: {detail}. Falling back to 4K upscale", progress=95)
             await loop.run_in_executor(None, utils.run_ffmpeg_scale_2160p, src, out_abs)
 
     except Exception as e:
-        job["status"] = "failed"
-        job["message"] = f"Failed: {e}"
-        job["progress"] = 100
+        job.update(status="failed", message=f"Failed: {e}", progress=100)
         return
     finally:
-        # Cleanup work dir (best-effort)
+        # Let background audio extraction finish before its output dir is removed
+        if audio_task is not None:
+            try:
+                await audio_task
+            except Exception:
+                pass
+        utils.close_log(log_path)
+        # Cleanup staging + work dir (best-effort)
         try:
+            if stage_dir != work_dir:
+                shutil.rmtree(stage_dir, ignore_errors=True)
+            utils.release_staging(job_id)
             if work_dir.exists():
                 shutil.rmtree(work_dir, ignore_errors=True)
         except Exception:
             pass
 
     # Success
-    job["status"] = "completed"
-    job["message"] = "Completed"
-    job["progress"] = 100
-    job["resultPath"] = out_abs
-    job["resultUrl"] = public_url
+    job.update(status="completed", message="Completed", progress=100, result_path=out_abs, result_url=public_url)